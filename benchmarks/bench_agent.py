@@ -0,0 +1,293 @@
+"""End-to-end latency and throughput benchmark for the agent and the API.
+
+Runs queries through PerplexityAgent.run (threads), PerplexityAgent.arun (asyncio) and the
+FastAPI /query endpoint (in-process ASGI client) at several concurrency levels, against the
+local SimulatedBackend, and writes the results as JSON so runs can be compared across commits.
+
+Run with: python benchmarks/bench_agent.py --concurrency 1,8,32 --queries 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "perplexity-agent"))
+sys.path.insert(0, os.path.join(ROOT, "fastapi-react", "fastapi_backend"))
+
+from agent import PerplexityAgent
+from llm_backend import RateLimitedBackend, SimulatedBackend
+from rate_limit import AdaptiveRateLimiter
+
+
+def make_queries(count: int, repeat_ratio: float = 0.0) -> List[str]:
+    """Distinct queries, with a share of exact repeats to exercise the caches."""
+    unique = max(1, round(count * (1 - repeat_ratio)))
+    return [
+        f"How did topic{i % unique} change market{(i % unique) * 7} in region{(i % unique) * 13}?"
+        for i in range(count)
+    ]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def summarize(name: str, concurrency: int, latencies: List[float], wall: float,
+              backend: SimulatedBackend, errors: int) -> Dict:
+    """Aggregate one scenario into a result record."""
+    stats = backend.stats()
+    queries = len(latencies)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "queries": queries,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "queries_per_second": round(queries / wall, 3) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        "upstream_calls_per_query": round(stats["total_calls"] / queries, 3) if queries else 0.0,
+        "upstream_calls": stats["calls"],
+        "upstream_failures": stats["failures"],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def make_agent(args, backend: SimulatedBackend) -> PerplexityAgent:
+    """A fresh agent, with caches disabled unless benchmarking them."""
+    if args.rate_limit:
+        limiter = AdaptiveRateLimiter(requests_per_second=args.rate_limit_rps)
+        # Backoffs follow the simulated time scale
+        backend = RateLimitedBackend(backend, limiter, base_backoff=0.5 * args.time_scale)
+    hedging = {"hedge_quantile": args.hedge_quantile or None, "hedge_budget": args.hedge_budget}
+    if args.with_caches:
+        return PerplexityAgent(backend=backend, **hedging)
+    return PerplexityAgent(backend=backend, research_cache_size=0, answer_cache_size=0, **hedging)
+
+
+def make_backend(args) -> SimulatedBackend:
+    return SimulatedBackend(
+        time_scale=args.time_scale,
+        error_rate=args.error_rate,
+        requests_per_second=args.quota,
+        seed=args.seed
+    )
+
+
+def bench_sync(args, concurrency: int, queries: List[str]) -> Dict:
+    """PerplexityAgent.run from a thread pool."""
+    backend = make_backend(args)
+    agent = make_agent(args, backend)
+    latencies: List[float] = []
+    errors = 0
+
+    def one(query: str) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        answer = agent.run(query)
+        latencies.append(time.perf_counter() - start)
+        if answer.startswith("Error:"):
+            errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    wall = time.perf_counter() - start
+
+    return summarize("agent.run", concurrency, latencies, wall, backend, errors)
+
+
+async def run_bounded(concurrency: int, queries: List[str], one: Callable) -> float:
+    """Run one(query) for every query with at most `concurrency` in flight, return wall time."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(query: str) -> None:
+        async with semaphore:
+            await one(query)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(query) for query in queries))
+    return time.perf_counter() - start
+
+
+def bench_async(args, concurrency: int, queries: List[str]) -> Dict:
+    """PerplexityAgent.arun on one event loop."""
+    backend = make_backend(args)
+    agent = make_agent(args, backend)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(query: str) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        answer = await agent.arun(query)
+        latencies.append(time.perf_counter() - start)
+        if answer.startswith("Error:"):
+            errors += 1
+
+    wall = asyncio.run(run_bounded(concurrency, queries, one))
+
+    return summarize("agent.arun", concurrency, latencies, wall, backend, errors)
+
+
+def bench_api(args, concurrency: int, queries: List[str]) -> Dict:
+    """POST /query through an in-process ASGI client."""
+    import httpx
+    import fastapi_app
+
+    backend = make_backend(args)
+    fastapi_app.agent = make_agent(args, backend)
+    latencies: List[float] = []
+    errors = 0
+
+    async def main() -> float:
+        transport = httpx.ASGITransport(app=fastapi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def one(query: str) -> None:
+                nonlocal errors
+                start = time.perf_counter()
+                response = await client.post("/query", json={"query": query})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+            return await run_bounded(concurrency, queries, one)
+
+    wall = asyncio.run(main())
+
+    return summarize("api /query", concurrency, latencies, wall, backend, errors)
+
+
+SCENARIOS = {
+    "sync": bench_sync,
+    "async": bench_async,
+    "api": bench_api,
+}
+
+
+def traced_peak_mb(scenario: Callable, args, concurrency: int, queries: List[str]) -> float:
+    """Peak Python heap of a scenario, measured in a separate run since tracing slows it down."""
+    tracemalloc.start()
+    try:
+        scenario(args, concurrency, queries)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1e6, 3)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(baseline_path: str, results: List[Dict]) -> None:
+    """Print the change of the key metrics against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+
+    print(f"Compared with {baseline.get('commit', '?')} ({baseline_path}):")
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+
+        def change(now: float, then: float) -> str:
+            return f"{(now - then) / then * 100:+6.1f}%" if then else "   n/a"
+
+        print(
+            f"{result['scenario']:<12} c={result['concurrency']:<4} "
+            f"p50 {change(result['latency_ms']['p50'], before['latency_ms']['p50'])} "
+            f"p99 {change(result['latency_ms']['p99'], before['latency_ms']['p99'])} "
+            f"qps {change(result['queries_per_second'], before['queries_per_second'])} "
+            f"calls/q {change(result['upstream_calls_per_query'], before['upstream_calls_per_query'])}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenarios", default="sync,async,api", help="comma-separated: sync, async, api")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--queries", type=int, default=64, help="queries per scenario and level")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="multiplier of the simulated latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of simulated calls failing")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of repeated queries")
+    parser.add_argument("--quota", type=float, help="simulated quota in calls per second, 429 above it")
+    parser.add_argument("--rate-limit", action="store_true", help="admit calls through the adaptive rate limiter")
+    parser.add_argument("--rate-limit-rps", type=float, help="quota given to the rate limiter (adapts when unset)")
+    parser.add_argument("--hedge-quantile", type=float, default=0.9,
+                        help="latency quantile after which research calls are hedged (0 disables hedging)")
+    parser.add_argument("--hedge-budget", type=float, default=0.1, help="extra research calls allowed per call")
+    parser.add_argument("--with-caches", action="store_true", help="keep the research and answer caches on")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also measure the peak Python heap of each scenario (extra, untimed run)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries, args.repeat_ratio)
+    results = []
+    for scenario in args.scenarios.split(","):
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            run = SCENARIOS[scenario.strip()]
+            result = run(args, concurrency, queries)
+            if args.trace_memory:
+                result["peak_heap_mb"] = traced_peak_mb(run, args, concurrency, queries)
+            results.append(result)
+            latency = result["latency_ms"]
+            print(
+                f"{result['scenario']:<12} c={concurrency:<4} "
+                f"p50={latency['p50']:>9.1f}ms p95={latency['p95']:>9.1f}ms p99={latency['p99']:>9.1f}ms "
+                f"qps={result['queries_per_second']:>8.2f} calls/q={result['upstream_calls_per_query']:.2f} "
+                f"rss={result['peak_rss_mb']:.0f}MB errors={result['errors']}"
+            )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Graph orchestration overhead per query, with a backend that answers instantly.
+
+Everything measured here is the agent's own work (LangGraph scheduling, state updates and
+reducers, node instrumentation, fan-out and prompts) since model calls cost nothing. Runs
+PerplexityAgent.run and arun one query at a time, in parallel and sequential mode, for
+several subtask counts, and writes the results as JSON. Each scenario is repeated and its
+fastest repetition kept, to filter out scheduling noise. With --compare, exits with an error
+when the median overhead grew by more than --max-regression percent, to guard the gains.
+
+Run with: python benchmarks/bench_orchestration.py --subtasks 1,3,10,30 --queries 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "perplexity-agent"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from agent import PerplexityAgent
+from bench_agent import git_commit, percentile
+from llm_backend import LLMBackend, LLMResponse
+
+
+class NoopBackend(LLMBackend):
+    """Answers every call at once: decompose with `subtasks` subtasks, other nodes with a short text."""
+
+    def __init__(self, subtasks: int = 3):
+        self.subtasks = subtasks
+
+    def _respond(self, node: str, prompt: str) -> LLMResponse:
+        if node == "decompose":
+            match = re.search(r"Query:\s*(.+)", prompt)
+            query = match.group(1).strip() if match else ""
+            return LLMResponse(json.dumps([f"Aspect {i + 1} of: {query}" for i in range(self.subtasks)]))
+        return LLMResponse(f"Noop {node} answer.")
+
+    def generate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        return self._respond(node, prompt)
+
+    async def agenerate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        return self._respond(node, prompt)
+
+
+def make_agent(subtasks: int, parallel: bool) -> PerplexityAgent:
+    """An agent doing every step of every query: no caches, no fast path."""
+    return PerplexityAgent(
+        backend=NoopBackend(subtasks),
+        parallel=parallel,
+        research_cache_size=0,
+        answer_cache_size=0,
+        fast_path=False
+    )
+
+
+def measure(agent: PerplexityAgent, mode: str, queries: List[str], warmup: int) -> List[float]:
+    """Seconds spent on each query, run one after another."""
+    def timed_sync(query: str) -> float:
+        start = time.perf_counter()
+        agent.run(query)
+        return time.perf_counter() - start
+
+    async def timed_async(query: str) -> float:
+        start = time.perf_counter()
+        await agent.arun(query)
+        return time.perf_counter() - start
+
+    if mode == "run":
+        for query in queries[:warmup]:
+            timed_sync(f"warmup {query}")
+        return [timed_sync(query) for query in queries]
+
+    async def main() -> List[float]:
+        for query in queries[:warmup]:
+            await timed_async(f"warmup {query}")
+        return [await timed_async(query) for query in queries]
+
+    return asyncio.run(main())
+
+
+def bench(mode: str, parallel: bool, subtasks: int, args) -> Dict:
+    agent = make_agent(subtasks, parallel)
+    queries = [f"How did topic{i} change market{i * 7} in region{i * 13}?" for i in range(args.queries)]
+    durations = min(
+        (measure(agent, mode, queries, args.warmup if repetition == 0 else 0) for repetition in range(args.repeat)),
+        key=lambda run: percentile(run, 50)
+    )
+    return {
+        "scenario": f"{mode} {'parallel' if parallel else 'sequential'}",
+        "subtasks": subtasks,
+        "queries": len(durations),
+        "overhead_us": {
+            "mean": round(statistics.mean(durations) * 1e6, 1),
+            "p50": round(percentile(durations, 50) * 1e6, 1),
+            "p99": round(percentile(durations, 99) * 1e6, 1),
+        },
+        "per_node_us": round(statistics.mean(durations) * 1e6 / (subtasks + 2), 1),
+    }
+
+
+def compare(baseline_path: str, results: List[Dict], max_regression: float) -> bool:
+    """Print the change of the median overhead against a previous results file; False on a regression."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["subtasks"]): r for r in baseline["results"]}
+
+    print(f"Compared with {baseline.get('commit', '?')} ({baseline_path}):")
+    ok = True
+    for result in results:
+        before = previous.get((result["scenario"], result["subtasks"]))
+        if before is None:
+            continue
+        now, then = result["overhead_us"]["p50"], before["overhead_us"]["p50"]
+        change = (now - then) / then * 100
+        regressed = change > max_regression
+        ok = ok and not regressed
+        print(
+            f"{result['scenario']:<16} subtasks={result['subtasks']:<4} "
+            f"p50 {then:>9.1f}us -> {now:>9.1f}us ({change:+6.1f}%){'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--modes", default="run,arun", help="comma-separated: run, arun")
+    parser.add_argument("--graphs", default="parallel,sequential", help="comma-separated: parallel, sequential")
+    parser.add_argument("--subtasks", default="1,3,10,30", help="comma-separated subtask counts per query")
+    parser.add_argument("--queries", type=int, default=200, help="measured queries per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed queries run first")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of each scenario, the fastest is kept")
+    parser.add_argument("--output", default="bench_orchestration.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=15.0,
+                        help="median overhead increase, in percent, failing the comparison")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes.split(","):
+        for graph in args.graphs.split(","):
+            for subtasks in (int(count) for count in args.subtasks.split(",")):
+                result = bench(mode.strip(), graph.strip() == "parallel", subtasks, args)
+                results.append(result)
+                overhead = result["overhead_us"]
+                print(
+                    f"{result['scenario']:<16} subtasks={subtasks:<4} "
+                    f"mean={overhead['mean']:>9.1f}us p50={overhead['p50']:>9.1f}us p99={overhead['p99']:>9.1f}us "
+                    f"per node={result['per_node_us']:>8.1f}us"
+                )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare and not compare(args.compare, results, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
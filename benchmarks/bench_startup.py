@@ -0,0 +1,176 @@
+"""Cold start of the agent and API processes: import times and time to the first healthy response.
+
+Every measurement runs in a fresh interpreter, so nothing is already imported or cached:
+the import of agent.py and of fastapi_app.py, the warm-up of an agent (graph compilation,
+SDK imports, client creation), and a uvicorn server started from scratch, timed until its
+health check (GET /) and its readiness check (GET /ready) first answer 200. Uses the
+simulated backend, so no API key is needed. Writes the medians as JSON; with --compare,
+exits with an error when one grew by more than --max-regression percent.
+
+Run with: python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENT_DIR = os.path.join(ROOT, "perplexity-agent")
+API_DIR = os.path.join(ROOT, "fastapi-react", "fastapi_backend")
+sys.path.insert(0, AGENT_DIR)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_agent import git_commit, percentile
+
+# Each snippet prints the seconds it measured
+IMPORT_AGENT = "import time; start = time.perf_counter(); import agent; print(time.perf_counter() - start)"
+IMPORT_API = "import time; start = time.perf_counter(); import fastapi_app; print(time.perf_counter() - start)"
+WARM_UP = (
+    "import time; import agent; a = agent.PerplexityAgent(); "
+    "start = time.perf_counter(); a.warm_up(); print(time.perf_counter() - start)"
+)
+
+
+def bench_env() -> Dict[str, str]:
+    env = dict(os.environ, PERPLEXITY_BACKEND="simulated", PYTHONWARNINGS="ignore")
+    env.pop("PERPLEXITY_WARMUP", None)
+    return env
+
+
+def timed_snippet(code: str, cwd: str) -> float:
+    """Seconds printed by a snippet run in a new interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, env=bench_env(), capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def status(url: str) -> Optional[int]:
+    """HTTP status of a GET, None while the server doesn't accept connections."""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None
+
+
+def server_start(timeout: float, poll_interval: float) -> Dict[str, float]:
+    """Seconds from spawning uvicorn until / then /ready first answer 200."""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR, env=bench_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    timings = {}
+    try:
+        for name, path in (("healthy_s", "/"), ("ready_s", "/ready")):
+            while status(base + path) != 200:
+                if server.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"{path} not ready after {timeout}s")
+                time.sleep(poll_interval)
+            timings[name] = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+
+def summarize(name: str, samples: List[float]) -> Dict:
+    return {
+        "metric": name,
+        "runs": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "min_ms": round(min(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+def compare(baseline_path: str, results: List[Dict], max_regression: float) -> bool:
+    """Print the change of every median against a previous results file; False on a regression."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {r["metric"]: r for r in baseline["results"]}
+
+    print(f"Compared with {baseline.get('commit', '?')} ({baseline_path}):")
+    ok = True
+    for result in results:
+        before = previous.get(result["metric"])
+        if before is None:
+            continue
+        now, then = result["p50_ms"], before["p50_ms"]
+        change = (now - then) / then * 100
+        regressed = change > max_regression
+        ok = ok and not regressed
+        print(
+            f"{result['metric']:<20} p50 {then:>8.1f}ms -> {now:>8.1f}ms ({change:+6.1f}%)"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes started per measurement")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the server to be ready")
+    parser.add_argument("--poll-interval", type=float, default=0.005, help="seconds between health check polls")
+    parser.add_argument("--no-server", action="store_true", help="only measure imports and warm-up")
+    parser.add_argument("--output", default="bench_startup.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="median increase, in percent, failing the comparison")
+    args = parser.parse_args()
+
+    samples: Dict[str, List[float]] = {
+        "import_agent": [timed_snippet(IMPORT_AGENT, AGENT_DIR) for _ in range(args.repeat)],
+        "import_fastapi_app": [timed_snippet(IMPORT_API, API_DIR) for _ in range(args.repeat)],
+        "agent_warm_up": [timed_snippet(WARM_UP, AGENT_DIR) for _ in range(args.repeat)],
+    }
+    if not args.no_server:
+        starts = [server_start(args.timeout, args.poll_interval) for _ in range(args.repeat)]
+        samples["first_healthy"] = [start["healthy_s"] for start in starts]
+        samples["first_ready"] = [start["ready_s"] for start in starts]
+
+    results = [summarize(name, values) for name, values in samples.items()]
+    for result in results:
+        print(
+            f"{result['metric']:<20} p50={result['p50_ms']:>8.1f}ms "
+            f"min={result['min_ms']:>8.1f}ms max={result['max_ms']:>8.1f}ms"
+        )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare and not compare(args.compare, results, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,71 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio
+import json
 import os
 import sys
-from typing import Dict, List, Optional, Any
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Any
 from pydantic import BaseModel
 
 # Add parent directory to path to be able to import the agent module
 perplexity_agent_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "perplexity-agent")
 sys.path.append(perplexity_agent_path)
 from agent import PerplexityAgent
+from telemetry import Trace, metrics
+from jobs import JobQueue, MemoryJobStore, QueueFullError, SQLiteJobStore
+
+def make_job_store():
+    """SQLite when PERPLEXITY_JOBS_DB is set (jobs survive restarts), in memory otherwise."""
+    path = os.environ.get("PERPLEXITY_JOBS_DB")
+    return SQLiteJobStore(path) if path else MemoryJobStore()
+
+def run_job(query: str, callbacks: Dict[str, Callable], thread_id: str):
+    """Run a job, checkpointed on its thread only when checkpoints survive a restart to resume it."""
+    if not agent.persistent_checkpoints:
+        thread_id = None
+    return agent.arun(query=query, callbacks=callbacks, thread_id=thread_id)
+
+# Queued jobs run in the background, at most PERPLEXITY_JOB_WORKERS at a time
+jobs = JobQueue(
+    make_job_store(),
+    run=run_job,
+    workers=int(os.environ.get("PERPLEXITY_JOB_WORKERS", 4)),
+    max_depth=int(os.environ.get("PERPLEXITY_JOB_QUEUE_DEPTH", 100)),
+    forget_thread=lambda thread_id: agent.delete_thread(thread_id)
+)
+
+# Warm-up of the agent (graph compilation, SDK imports, client creation), "background" by
+# default so the server answers health checks at once, "startup" to finish it before serving
+# requests, or "off" to leave it to the first query
+warm_up_state: Dict[str, Any] = {"ready": False, "error": None}
+
+def warm_up_agent():
+    try:
+        agent.warm_up()
+        warm_up_state["ready"] = True
+    except Exception as e:
+        warm_up_state["error"] = str(e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    mode = os.environ.get("PERPLEXITY_WARMUP", "background").lower()
+    warm_up = None
+    if mode == "startup":
+        await asyncio.to_thread(warm_up_agent)
+    elif mode == "background":
+        warm_up = asyncio.create_task(asyncio.to_thread(warm_up_agent))
+    else:
+        warm_up_state["ready"] = True
+    await jobs.start()
+    yield
+    await jobs.stop()
+    if warm_up is not None:
+        await warm_up
 
 # Initialize FastAPI app
-app = FastAPI(title="Perplexity Agent API")
+app = FastAPI(title="Perplexity Agent API", lifespan=lifespan)
 
 # Add CORS middleware to allow cross-origin requests from the React app
 app.add_middleware(
@@ -23,17 +77,39 @@ app.add_middleware(
 )
 
 # Create agent instance
-agent = PerplexityAgent()
+# (PERPLEXITY_CACHE_DB makes every worker process share its research and answer caches,
+# PERPLEXITY_COMPRESSION_RATIO compresses the research before synthesis)
+compression_ratio = os.environ.get("PERPLEXITY_COMPRESSION_RATIO")
+agent = PerplexityAgent(
+    # SQLite when PERPLEXITY_CHECKPOINT_DB is set (runs resume after a restart), in memory
+    # otherwise; opened with the graph, so LangGraph stays off the import path
+    checkpoint_path=os.environ.get("PERPLEXITY_CHECKPOINT_DB") or None,
+    shared_cache_path=os.environ.get("PERPLEXITY_CACHE_DB"),
+    compression_ratio=float(compression_ratio) if compression_ratio else None
+)
 
 # Define request model
 class QueryRequest(BaseModel):
     query: str
+    trace: bool = False  # Return the span tree of the run
+    thread_id: Optional[str] = None  # Checkpoint the run; resending the query resumes it
+    conversation_id: Optional[str] = None  # Answer as a follow-up, reusing the conversation's research
+    deadline_ms: Optional[int] = None  # Answer within this latency budget, with the research finished by then
+
+class BatchRequest(BaseModel):
+    queries: List[str]
+    concurrency: int = 8  # Node executions running at once
+
+class JobRequest(BaseModel):
+    query: str
+    priority: int = 0  # Higher runs first
 
 # Define response model
 class QueryResult(BaseModel):
     subtasks: List[str]
     results: List[Dict[str, str]]  # List of task and result pairs
     answer: str
+    trace: Optional[Dict[str, Any]] = None
 
 # API routes
 @app.get("/")
@@ -41,9 +117,38 @@ async def root():
     """Health check endpoint"""
     return {"status": "ok", "message": "Perplexity Agent API is running"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 503 until the agent is warmed up"""
+    if not warm_up_state["ready"]:
+        status = "failed" if warm_up_state["error"] else "warming_up"
+        raise HTTPException(status_code=503, detail={"status": status, "error": warm_up_state["error"]})
+    return {"status": "ready"}
+
+@app.get("/stats")
+async def stats():
+    """Cache, coalescing, hedging, rate limiter and job queue statistics"""
+    return {
+        "research_cache": agent.research_cache.stats(),
+        "answer_cache": agent.answer_cache.stats(),
+        "query_coalescing": agent.async_query_flights.stats(),
+        "research_coalescing": agent.async_research_flights.stats(),
+        "research_hedging": agent.research_hedger.stats(),
+        "conversations": agent.conversations.stats(),
+        "jobs": jobs.stats(),
+        "backend": agent.backend.stats()
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Latency, token and cache metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/query", response_model=QueryResult)
 async def process_query(request: QueryRequest):
     """Process a query and return the results"""
+    if request.deadline_ms is not None and request.deadline_ms <= 0:
+        raise HTTPException(status_code=422, detail="deadline_ms must be positive")
     try:
         # Store results
         subtasks_list = []
@@ -72,19 +177,133 @@ async def process_query(request: QueryRequest):
             "on_answer_complete": on_answer_complete
         }
         
-        # Run the agent with the callbacks
-        agent.run(query=request.query, callbacks=callbacks)
+        trace = Trace(query=request.query) if request.trace else None
+        
+        # Run the agent with the callbacks without blocking the event loop
+        await agent.arun(
+            query=request.query,
+            callbacks=callbacks,
+            trace=trace,
+            thread_id=request.thread_id,
+            conversation_id=request.conversation_id,
+            deadline_ms=request.deadline_ms
+        )
         
         # Return the results
         return QueryResult(
             subtasks=subtasks_list,
             results=results_list,
-            answer=final_answer
+            answer=final_answer,
+            trace=trace.to_dict() if trace else None
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+@app.post("/query/batch")
+async def process_batch(request: BatchRequest):
+    """Answer many queries, researching shared subtasks once; streams one JSON line per query as it completes"""
+    if not 1 <= request.concurrency <= 64:
+        raise HTTPException(status_code=422, detail="concurrency must be between 1 and 64")
+    
+    async def result_lines():
+        async for index, answer in agent.arun_batch(request.queries, request.concurrency):
+            yield json.dumps({"index": index, "query": request.queries[index], "answer": answer}) + "\n"
+    
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """Queue a query and return its job id right away"""
+    try:
+        job = jobs.submit(request.query, request.priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Status, progress and answer of a job; with wait, hold the request up to that many seconds until it finishes"""
+    # Stay below the usual 30s proxy timeouts
+    job = await jobs.wait(job_id, min(wait, 25)) if wait > 0 else jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+def sse_frame(event: str, data: Any) -> str:
+    """Format a single Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/query/stream")
+async def stream_query(
+    query: str,
+    thread_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    deadline_ms: Optional[int] = None
+):
+    """Process a query and stream progress and answer tokens as Server-Sent Events"""
+    if deadline_ms is not None and deadline_ms <= 0:
+        raise HTTPException(status_code=422, detail="deadline_ms must be positive")
+    
+    # Frames produced by the callbacks, None marks the end of the stream
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    def emit(event: str, data: Any = None):
+        queue.put_nowait(sse_frame(event, data))
+    
+    # Forward every agent callback as an event
+    callbacks = {
+        "on_decompose_start": lambda: emit("decompose_start"),
+        "on_subtasks": lambda subtasks: emit("subtasks", subtasks),
+        "on_task_start": lambda task: emit("task_start", {"task": task}),
+        "on_task_complete": lambda task, result: emit("task_complete", {"task": task, "result": result}),
+        "on_synthesize_start": lambda: emit("synthesize_start"),
+        "on_answer_token": lambda token: emit("answer_token", token),
+        "on_answer_complete": lambda answer: emit("answer", answer)
+    }
+    
+    async def run_agent():
+        try:
+            await agent.arun(
+                query=query,
+                callbacks=callbacks,
+                thread_id=thread_id,
+                conversation_id=conversation_id,
+                deadline_ms=deadline_ms
+            )
+        except Exception as e:
+            emit("error", f"An error occurred: {str(e)}")
+        finally:
+            emit("done")
+            queue.put_nowait(None)
+    
+    async def event_stream():
+        task = asyncio.create_task(run_agent())
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            # Stop the agent if the client went away
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Run with: uvicorn fastapi_app:app --reload
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,302 @@
+import asyncio
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+@dataclass
+class Job:
+    """A query submitted through the job API, with its progress and outcome."""
+    query: str
+    priority: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    subtasks: List[str] = field(default_factory=list)
+    results: List[Dict[str, str]] = field(default_factory=list)
+    answer: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class QueueFullError(Exception):
+    """The job queue already holds its maximum number of queued jobs."""
+
+
+class JobStore(ABC):
+    """Where jobs are kept, so they can be polled and survive restarts."""
+
+    @abstractmethod
+    def save(self, job: Job) -> None:
+        """Insert or update a job."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """A job by id, if known."""
+
+    @abstractmethod
+    def unfinished(self) -> List[Job]:
+        """Jobs still queued or running, oldest first."""
+
+
+class MemoryJobStore(JobStore):
+    """Jobs in a dict: fast, but lost on restart. The oldest finished jobs are dropped past max_jobs."""
+
+    def __init__(self, max_jobs: int = 10_000):
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            if len(self._jobs) > self.max_jobs:
+                finished = [job_id for job_id, old in self._jobs.items() if old.finished]
+                for job_id in finished[:len(self._jobs) - self.max_jobs]:
+                    del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if not job.finished]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+
+class SQLiteJobStore(JobStore):
+    """Jobs in a SQLite file, one JSON document per job."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def save(self, job: Job) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, created_at, data) VALUES (?, ?, ?, ?)",
+                (job.id, job.status, job.created_at, json.dumps(job.to_dict()))
+            )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [Job(**json.loads(row[0])) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Runs a query with the agent callbacks on the checkpoint thread of its job and returns the
+# answer, or an "Error: ..." message for a failed run, e.g. PerplexityAgent.arun
+RunQuery = Callable[[str, Dict[str, Callable], str], Awaitable[Any]]
+
+
+class JobQueue:
+    """Bounded priority queue of jobs, run by a fixed pool of asyncio workers.
+
+    Higher priorities run first, equal priorities in submission order. Jobs left queued
+    or running by a previous process are queued again on start; the job id is the thread
+    of its run, so with persistent checkpoints an interrupted job resumes from its last one.
+    The checkpoints of a job are deleted once it is finished.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        run: RunQuery,
+        workers: int = 4,
+        max_depth: int = 100,
+        forget_thread: Optional[Callable[[str], Any]] = None
+    ):
+        self.store = store
+        self.run = run
+        # Deletes the checkpoints of a finished job's thread (called on a worker thread)
+        self.forget_thread = forget_thread
+        self.workers = workers
+        self.max_depth = max_depth
+
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._order = itertools.count()
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._jobs: Dict[str, Job] = {}
+
+    async def start(self) -> None:
+        """Recover unfinished jobs and start the workers."""
+        self._queue = asyncio.PriorityQueue()
+        for job in self.store.unfinished():
+            job.status = QUEUED
+            job.started_at = None
+            self._enqueue(job)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers; interrupted jobs stay running in the store and resume on next start."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def _enqueue(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        self._finished[job.id] = asyncio.Event()
+        self.store.save(job)
+        self._queue.put_nowait((-job.priority, next(self._order), job.id))
+
+    def submit(self, query: str, priority: int = 0) -> Job:
+        """Queue a query and return its job right away."""
+        if self.depth >= self.max_depth:
+            raise QueueFullError(f"The queue already holds {self.max_depth} jobs")
+        job = Job(query=query, priority=priority)
+        self._enqueue(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """A job by id, from this process or the store."""
+        return self._jobs.get(job_id) or self.store.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Long-poll: return the job once finished, or as it is after timeout seconds."""
+        job = self.get(job_id)
+        event = self._finished.get(job_id)
+        if job is None or job.finished or event is None:
+            return job
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job."""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job or self.store.get(job_id)
+        if job.status == QUEUED:
+            # Its queue entry is skipped by the workers
+            self._finish(job, CANCELLED)
+        else:
+            job.status = CANCELLED
+            self._running[job_id].cancel()
+        return job
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        self.store.save(job)
+        self._finished.pop(job.id).set()
+        # Finished jobs are served from the store from now on
+        self._jobs.pop(job.id, None)
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                continue
+
+            job.status = RUNNING
+            job.started_at = time.time()
+            # Progress of an interrupted earlier attempt is replayed from its checkpoint
+            job.subtasks, job.results, job.answer = [], [], None
+            self.store.save(job)
+
+            task = asyncio.ensure_future(self.run(job.query, self._callbacks(job), job.id))
+            self._running[job.id] = task
+            try:
+                answer = await task
+            except asyncio.CancelledError:
+                if job.status != CANCELLED:
+                    # The worker itself is stopping
+                    task.cancel()
+                    raise
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                self._finish(job, FAILED, str(e))
+            else:
+                # The agent reports a failed run with an "Error: ..." answer instead of raising
+                if isinstance(answer, str) and answer.startswith("Error:"):
+                    self._finish(job, FAILED, answer)
+                else:
+                    job.answer = job.answer or answer
+                    self._finish(job, SUCCEEDED)
+            finally:
+                self._running.pop(job.id, None)
+
+            # A finished job is never resumed, its checkpoints are only taking space
+            # (shielded: the deletion completes even if the worker is being stopped)
+            if self.forget_thread is not None:
+                await asyncio.shield(asyncio.to_thread(self.forget_thread, job.id))
+
+    def _callbacks(self, job: Job) -> Dict[str, Callable]:
+        """Agent callbacks recording the progress of a job."""
+        def on_subtasks(subtasks: List[str]):
+            job.subtasks = list(subtasks)
+            self.store.save(job)
+
+        def on_task_complete(task: str, result: str):
+            job.results.append({"task": task, "result": result})
+            self.store.save(job)
+
+        def on_answer_complete(answer: str):
+            job.answer = answer
+
+        return {
+            "on_subtasks": on_subtasks,
+            "on_task_complete": on_task_complete,
+            "on_answer_complete": on_answer_complete
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.depth,
+            "running": len(self._running),
+            "max_depth": self.max_depth,
+            "workers": self.workers,
+        }
@@ -1,7 +1,6 @@
 import React, { useState } from 'react';
 import './App.css';
 import ReactMarkdown from 'react-markdown';
-import axios from 'axios';
 
 const API_URL = 'http://localhost:8000';
 
@@ -13,37 +12,56 @@ function App() {
   const [finalAnswer, setFinalAnswer] = useState('');
   const [error, setError] = useState('');
   
-  const handleSubmit = async (e) => {
+  const handleSubmit = (e) => {
     e.preventDefault();
     
     if (!query.trim() || isLoading) {
       return;
     }
     
-    try {
-      // Reset states
-      setSubtasks([]);
-      setResults([]);
-      setFinalAnswer('');
-      setError('');
-      setIsLoading(true);
-      
-      // Make API request
-      const response = await axios.post(`${API_URL}/query`, {
-        query: query
-      });
-      
-      // Update state with response data
-      setSubtasks(response.data.subtasks);
-      setResults(response.data.results);
-      setFinalAnswer(response.data.answer);
-      
-    } catch (err) {
-      console.error('Error processing query:', err);
-      setError(err.response?.data?.detail || 'An error occurred processing your query.');
-    } finally {
+    // Reset states
+    setSubtasks([]);
+    setResults([]);
+    setFinalAnswer('');
+    setError('');
+    setIsLoading(true);
+    
+    // Stream progress events and answer tokens from the API
+    const events = new EventSource(`${API_URL}/query/stream?query=${encodeURIComponent(query)}`);
+    
+    events.addEventListener('subtasks', (e) => {
+      setSubtasks(JSON.parse(e.data));
+    });
+    
+    events.addEventListener('task_complete', (e) => {
+      const result = JSON.parse(e.data);
+      setResults((previous) => [...previous, result]);
+    });
+    
+    events.addEventListener('answer_token', (e) => {
+      const token = JSON.parse(e.data);
+      setFinalAnswer((previous) => previous + token);
+    });
+    
+    events.addEventListener('answer', (e) => {
+      // The complete answer replaces the streamed tokens
+      setFinalAnswer(JSON.parse(e.data));
+    });
+    
+    events.addEventListener('error', (e) => {
+      if (e.data) {
+        setError(JSON.parse(e.data));
+      } else if (events.readyState !== EventSource.CLOSED) {
+        setError('An error occurred processing your query.');
+      }
+      events.close();
       setIsLoading(false);
-    }
+    });
+    
+    events.addEventListener('done', () => {
+      events.close();
+      setIsLoading(false);
+    });
   };
   
   const handleNewSearch = () => {
@@ -85,7 +103,7 @@ function App() {
         
         {isLoading && (
           <div className="status-container">
-            <p className="status-message">Processing your query. This may take a minute...</p>
+            <p className="status-message">Processing your query...</p>
             <div className="loading-spinner"></div>
           </div>
         )}
@@ -96,7 +114,7 @@ function App() {
           </div>
         )}
         
-        {finalAnswer && (
+        {(subtasks.length > 0 || finalAnswer) && (
           <>
             <div className="content-container">
               <div className="column research-column">
@@ -131,19 +149,21 @@ function App() {
               <div className="column answer-column">
                 <h2>Answer</h2>
                 <div className="answer-container">
-                  <ReactMarkdown>{finalAnswer}</ReactMarkdown>
+                  {finalAnswer ? <ReactMarkdown>{finalAnswer}</ReactMarkdown> : <p>Creating your answer...</p>}
                 </div>
               </div>
             </div>
             
-            <div className="new-search-container">
-              <button 
-                onClick={handleNewSearch}
-                className="new-search-button"
-              >
-                New Search
-              </button>
-            </div>
+            {!isLoading && (
+              <div className="new-search-container">
+                <button 
+                  onClick={handleNewSearch}
+                  className="new-search-button"
+                >
+                  New Search
+                </button>
+              </div>
+            )}
           </>
         )}
       </main>
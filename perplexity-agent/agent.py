@@ -1,65 +1,271 @@
-import os
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import itertools
 import json
-from typing import Dict, List, Optional, TypedDict, Callable
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from langgraph.graph import END, StateGraph, START
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Annotated, Any, AsyncIterator, Awaitable, Dict, Hashable, Iterator, List, Mapping, Optional, Tuple, TypedDict, Callable
+from cache import TTLCache, make_key, normalize_text
+from compression import compress_results
+from context_packing import estimate_tokens, pack_context
+from conversation import ConversationStore
+from disk_cache import SQLiteCache, TieredCache
+from hedging import Hedger, LatencyTracker
+from json_stream import StringArrayParser
+from llm_backend import LLMBackend, LLMResponse, backend_from_env
+from query_cache import NearDuplicateCache
+from query_classifier import QueryClassifier
+from profiles import ProfileRegistry
+from singleflight import AsyncSingleFlight, FlightCallbacks, SingleFlight
+from telemetry import (
+    CACHE_LOOKUPS, COMPRESSION_RATIO, FALLBACKS, FAST_PATHS, LLM_OUTPUT_TOKENS, LLM_PROMPT_TOKENS, LLM_SECONDS, NODE_SECONDS, QUERY_SECONDS,
+    Span, Trace, attach, current_span, span
+)
+
+# LangGraph (and the LangChain stack under it) is imported when the graph is first built,
+# so importing this module stays fast for processes that only start up (health checks, workers)
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.checkpoint.base import BaseCheckpointSaver
+    from langgraph.graph import StateGraph
+    from langgraph.types import StateSnapshot
+    from langgraph.utils.runnable import RunnableCallable
+
 
-# Load environment variables
-load_dotenv()
+def merge_results(left: Optional[Dict[str, str]], right: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """Reducer that merges subtask results written by (possibly parallel) research nodes.
+    
+    Writing None clears the results, as decompose does when a thread starts a new query.
+    """
+    if right is None:
+        return {}
+    merged = dict(left or {})
+    merged.update(right or {})
+    return merged
 
-# Configure the API key
-api_key = os.environ.get("GOOGLE_API_KEY")
-# Initialize the client
-genai_client = genai.Client(api_key=api_key)
 
 # Define the typed state for our agent
 class AgentState(TypedDict):
     query: str  # The user's query
     subtasks: Optional[List[str]]  # The list of subtasks to complete
-    results: Dict[str, str]  # The results of each subtask
+    results: Annotated[Dict[str, str], merge_results]  # The results of each subtask
     current_subtask: Optional[str]  # The subtask currently being processed
+    cursor: Optional[int]  # Position in subtasks of the next subtask route may pick (sequential mode)
     final_answer: Optional[str]  # The final answer to the user's query
-    callbacks: Optional[Dict[str, Callable]]  # Callbacks for UI updates
-
-
-def get_model_config():
-    """Get a model configuration with search enabled."""
-    # Model configuration
-    model_id = "gemini-2.0-pro-exp-02-05"
-    
-    # Define generation config
-    generate_config = types.GenerateContentConfig(
-        temperature=0.7,
-        max_output_tokens=8192,
-        tools=[
-            types.Tool(google_search=types.GoogleSearch())
-        ],
-        system_instruction="""
-        You are an AI assistant that can search the web for information.
-        When asked questions about recent events, facts, or topics that require up-to-date information,
-        use the Google Search tool to find relevant information before responding.
-        Do not include or mention your sources in your responses.
-        """
-    )
-    
-    return model_id, generate_config
+    degraded: Optional[bool]  # Whether the answer comes from the local fallback instead of the model
+    fast_path: Optional[bool]  # Whether the query was simple enough to skip decomposition
+    history: Optional[Dict[str, Any]]  # Earlier turns and research results of the conversation (follow-ups)
+    evidence: Optional[Dict[str, str]]  # Compressed results given to synthesize, when the compress node runs
+    compression: Optional[Dict[str, float]]  # Tokens in and out, ratio and seconds of the compress node
 
 
-def decompose(state: AgentState) -> AgentState:
-    """Break down the query into subtasks."""
-    query = state["query"]
-    callbacks = state.get("callbacks", {})
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """Count a cache lookup and mark the current span as a hit or a miss."""
+    result = "hit" if hit else "miss"
+    CACHE_LOOKUPS.inc(cache=cache, result=result)
+    current = current_span()
+    if current is not None:
+        current.set(cache=result)
+
+
+def get_configurable(config: Optional[RunnableConfig], name: str):
+    """Get a shared resource (cache, coalescer...) passed in the run configuration, if any."""
+    return (config or {}).get("configurable", {}).get(name)
+
+
+def get_callbacks(config: Optional[RunnableConfig]) -> Dict[str, Callable]:
+    """Get the UI callbacks of the run, kept out of the state so it can be checkpointed."""
+    return get_configurable(config, "callbacks") or {}
+
+
+async def off_loop(cache: Any, func: Callable, *args) -> Any:
+    """Call a cache method, on a worker thread when the cache has a SQLite tier (`shared`).
     
-    if "on_decompose_start" in callbacks:
-        callbacks["on_decompose_start"]()
+    Its file I/O, lock waits (up to the busy timeout) and eviction scans then never block the event loop.
+    """
+    if getattr(cache, "shared", None) is None:
+        return func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+# Generation configs and backend used when a run doesn't provide its own, created on first use
+_defaults: Dict[str, Any] = {}
+_defaults_lock = threading.Lock()
+
+
+def _default(name: str, factory: Callable[[], Any]) -> Any:
+    """Create a process-wide default once, after loading the .env file."""
+    value = _defaults.get(name)
+    if value is None:
+        with _defaults_lock:
+            value = _defaults.get(name)
+            if value is None:
+                if not _defaults:
+                    # Load environment variables (only read by the defaults)
+                    from dotenv import load_dotenv
+                    load_dotenv()
+                value = _defaults[name] = factory()
+    return value
+
+
+def default_profiles() -> ProfileRegistry:
+    """Per-node model settings, with the PERPLEXITY_<NODE>_* overrides of the environment."""
+    return _default("profiles", ProfileRegistry)
+
+
+def default_backend() -> LLMBackend:
+    """Gemini unless PERPLEXITY_BACKEND=simulated."""
+    return _default("backend", backend_from_env)
+
+
+def get_model_config(config: Optional[RunnableConfig], node: str) -> Tuple[str, Any]:
+    """Get the prebuilt model id and generation config of a node."""
+    profiles = get_configurable(config, "profiles") or default_profiles()
+    return profiles.get(node)
+
+
+def get_backend(config: Optional[RunnableConfig]) -> LLMBackend:
+    """Get the LLM backend of the run."""
+    return get_configurable(config, "backend") or default_backend()
+
+
+def record_llm_call(llm_span, node: str, start: float, response: Optional[LLMResponse] = None,
+                    error: Optional[Exception] = None) -> None:
+    """Record the duration, outcome and token usage of a model call."""
+    outcome = "ok" if error is None else type(error).__name__
+    LLM_SECONDS.observe(time.perf_counter() - start, node=node, outcome=outcome)
+    if response is not None:
+        LLM_PROMPT_TOKENS.inc(response.prompt_tokens, node=node)
+        LLM_OUTPUT_TOKENS.inc(response.output_tokens, node=node)
+        llm_span.set(prompt_tokens=response.prompt_tokens, output_tokens=response.output_tokens)
+    llm_span.set(outcome=outcome)
+
+
+def record_fallback(node: str, error: Exception) -> None:
+    """Record that a node replaced a failed model call with a local result."""
+    FALLBACKS.inc(node=node)
+    node_span = current_span()
+    if node_span is not None:
+        node_span.set(fallback=True, error=f"{type(error).__name__}: {error}")
+
+
+def call_llm(config: Optional[RunnableConfig], node: str, prompt: str) -> LLMResponse:
+    """Generate a response with the node's model profile."""
+    model_id, generate_config = get_model_config(config, node)
+    with span("llm", node=node, model=model_id) as llm_span:
+        start = time.perf_counter()
+        try:
+            response = get_backend(config).generate(node, prompt, model_id, generate_config)
+        except Exception as e:
+            record_llm_call(llm_span, node, start, error=e)
+            raise
+        record_llm_call(llm_span, node, start, response)
+        return response
+
+
+async def acall_llm(config: Optional[RunnableConfig], node: str, prompt: str) -> LLMResponse:
+    """Async variant of call_llm."""
+    model_id, generate_config = get_model_config(config, node)
+    with span("llm", node=node, model=model_id) as llm_span:
+        start = time.perf_counter()
+        try:
+            response = await get_backend(config).agenerate(node, prompt, model_id, generate_config)
+        except Exception as e:
+            record_llm_call(llm_span, node, start, error=e)
+            raise
+        record_llm_call(llm_span, node, start, response)
+        return response
+
+
+def stream_llm(config: Optional[RunnableConfig], node: str, prompt: str) -> Iterator[str]:
+    """Generate a response chunk by chunk with the node's model profile."""
+    model_id, generate_config = get_model_config(config, node)
+    with span("llm", node=node, model=model_id, stream=True) as llm_span:
+        start = time.perf_counter()
+        chunks = []
+        response = None
+        try:
+            for chunk in get_backend(config).stream(node, prompt, model_id, generate_config):
+                # The stream ends with the complete response when the backend reports its usage
+                if isinstance(chunk, LLMResponse):
+                    response = chunk
+                    continue
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            record_llm_call(llm_span, node, start, error=e)
+            raise
+        if response is None:
+            # No usage reported, estimate it
+            text = "".join(chunks)
+            response = LLMResponse(text, estimate_tokens(prompt), estimate_tokens(text))
+        record_llm_call(llm_span, node, start, response)
+
+
+async def astream_llm(config: Optional[RunnableConfig], node: str, prompt: str) -> AsyncIterator[str]:
+    """Async variant of stream_llm."""
+    model_id, generate_config = get_model_config(config, node)
+    with span("llm", node=node, model=model_id, stream=True) as llm_span:
+        start = time.perf_counter()
+        chunks = []
+        response = None
+        try:
+            async for chunk in get_backend(config).astream(node, prompt, model_id, generate_config):
+                if isinstance(chunk, LLMResponse):
+                    response = chunk
+                    continue
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            record_llm_call(llm_span, node, start, error=e)
+            raise
+        if response is None:
+            text = "".join(chunks)
+            response = LLMResponse(text, estimate_tokens(prompt), estimate_tokens(text))
+        record_llm_call(llm_span, node, start, response)
+
+
+# Earlier answers are cut to this many characters in prompts
+HISTORY_ANSWER_CHARS = 500
+
+
+def conversation_context(history: Optional[Dict[str, Any]]) -> str:
+    """The earlier questions and answers of a conversation, for the prompts of a follow-up."""
+    turns = (history or {}).get("turns") or []
+    return "\n".join(
+        f"        - Q: {turn['query']}\n          A: {turn['answer'][:HISTORY_ANSWER_CHARS]}"
+        for turn in turns
+    )
+
+
+def decompose_prompt(query: str, history: Optional[Dict[str, Any]] = None) -> str:
+    """Prompt asking the model to break a query into subtasks.
     
-    try:
-        # Get model config
-        model_id, generate_config = get_model_config()
+    For a follow-up, the model sees the conversation and what is already researched, and
+    only asks for the research still missing.
+    """
+    if history:
+        researched = "\n".join(f"        - {subtask}" for subtask in history.get("results") or {}) or "        (nothing)"
+        return f"""
+        The following query is a follow-up in a conversation. Earlier in the conversation:
+{conversation_context(history)}
+        
+        Already researched:
+{researched}
+        
+        Break down the follow-up query into 0-3 simple high-level subtasks that still need to be researched to answer it effectively. Do not repeat anything already researched. Each subtask must be a clear, focused question that stands on its own (spell out what words like "that" or "last year" refer to).
+        
+        Query: {query}
         
-        prompt = f"""
+        Return a JSON array of subtask strings, or an empty array if the research above is enough to answer the query.
+        Example format: ["subtask 1", "subtask 2"]
+        """
+    return f"""
         Break down the following query into 1-3 simple high-level subtasks, if necessary, that need to be completed to answer it effectively:
         
         Query: {query}
@@ -67,248 +273,1426 @@ def decompose(state: AgentState) -> AgentState:
         Return a JSON array of subtask strings. Each subtask should be a clear, focused question that addresses a key aspect of the main query.
         Example format: ["subtask 1", "subtask 2", "subtask 3"]
         """
+
+
+def parse_subtasks(text: str, query: str) -> List[str]:
+    """Extract the JSON array of subtasks from the decompose response."""
+    # Extract JSON array
+    start_index = text.find("[")
+    end_index = text.rfind("]") + 1
+    
+    if start_index != -1 and end_index != -1:
+        json_str = text[start_index:end_index]
+        return json.loads(json_str)
+    
+    # Use the original query as a fallback
+    return [query]
+
+
+def research_prompt(subtask: str) -> str:
+    """Enhanced prompt that will trigger search."""
+    return f"""
+        {subtask}
         
-        # Create the content
-        contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
-        
-        # Generate content
-        response = genai_client.models.generate_content(
-            model=model_id,
-            contents=contents,
-            config=generate_config
-        )
-        
-        # Parse the response
-        response_text = response.candidates[0].content.parts[0].text.strip()
-        
-        # Extract JSON array
-        start_index = response_text.find("[")
-        end_index = response_text.rfind("]") + 1
-        
-        if start_index != -1 and end_index != -1:
-            json_str = response_text[start_index:end_index]
-            subtasks = json.loads(json_str)
-        else:
-            # Use the original query as a fallback
+        Research this question thoroughly and provide a detailed, accurate answer with facts and specific information.
+        Include relevant recent developments on this topic.
+        """
+
+
+# Token budget of the research context given to synthesize
+DEFAULT_CONTEXT_TOKENS = 2000
+
+
+def synthesize_prompt(
+    query: str,
+    results: Dict[str, str],
+    token_budget: int = DEFAULT_CONTEXT_TOKENS,
+    history: Optional[Dict[str, Any]] = None,
+    missing: Optional[List[str]] = None
+) -> str:
+    """Prompt combining the research results into the final answer.
+    
+    The `missing` subtasks (failed or abandoned research) are listed, so the answer says
+    which information is missing instead of guessing it.
+    """
+    # Failed research placeholders are no context
+    results = {subtask: result for subtask, result in results.items() if not research_failed(result)}
+    
+    # Keep the most relevant passages of the results within the token budget
+    # (a follow-up is ranked together with the question it follows)
+    turns = (history or {}).get("turns") or []
+    ranking_query = " ".join([turn["query"] for turn in turns[-1:]] + [query])
+    packed_results = pack_context(ranking_query, results, token_budget)
+    
+    # Prepare the context from the results
+    context_parts = []
+    for subtask, packed_result in packed_results.items():
+        context_parts.append(f"Context for '{subtask}':\n{packed_result}")
+    
+    context = "\n\n".join(context_parts)
+    
+    # Using the user-provided prompt format
+    prompt = f"""
+        Given a user question and some context, please write a clean, concise and accurate answer to the question based on the context. You will be given a set of related contexts to the question. Please use the context when crafting your answer.
+
+        Your answer must be correct, accurate and written by an expert using an unbiased and professional tone. Please limit to 1024 tokens. Do not give any information that is not related to the question, and do not repeat. Say "information is missing on" followed by the related topic, if the given context do not provide sufficient information.
+
+        Here are the set of contexts:
+        {context}
+
+        Remember, don't blindly repeat the contexts verbatim and don't tell the user how you used the citations – just respond with the answer. It is very important for my career that you follow these instructions. Here is the user question: {query}
+        """
+    if turns:
+        prompt += f"""
+        The question is a follow-up in a conversation, answer it in that context. Earlier in the conversation:
+{conversation_context(history)}
+        """
+    if missing:
+        topics = "\n".join(f"        - {subtask}" for subtask in missing)
+        prompt += f"""
+        No context could be gathered on the following topics, say "information is missing on" followed by each of them:
+{topics}
+        """
+    return prompt
+
+
+def fallback_answer(query: str, results: Dict[str, str], missing: Optional[List[str]] = None) -> str:
+    """Build a plain summary of the results when synthesis fails (or there is no time for it)."""
+    final_answer = f"# Answer to: {query}\n\n"
+    final_answer += "Based on the information gathered:\n\n"
+    
+    # Add a summary of each result
+    for subtask, result in results.items():
+        if research_failed(result):
+            continue
+        first_paragraph = result.split("\n")[0]
+        final_answer += f"- **{subtask}**: {first_paragraph}\n\n"
+    
+    # Name the subtasks without research
+    if missing:
+        final_answer += f"Information is missing on: {'; '.join(missing)}.\n"
+    
+    return final_answer
+
+
+# Every callback a caller may register, forwarded to all callers sharing a run
+CALLBACK_NAMES = (
+    "on_decompose_start",
+    "on_subtasks",
+    "on_task_start",
+    "on_task_complete",
+    "on_synthesize_start",
+    "on_answer_token",
+    "on_answer_degraded",
+    "on_answer_complete"
+)
+
+# Steps allowed to a sequential run, enough for about 500 subtasks
+SEQUENTIAL_RECURSION_LIMIT = 1000
+
+RESEARCH_ERROR = "I couldn't retrieve information for this subtask due to a technical issue."
+RESEARCH_TIMEOUT = "I couldn't retrieve information for this subtask before the deadline."
+
+# Expected synthesis time of a run with a deadline, until synthesis latencies are observed
+DEFAULT_SYNTHESIS_SECONDS = 3.0
+# Seconds also kept after the research cutoff for the steps around synthesis (graph steps, compress)
+DEADLINE_MARGIN = 0.1
+
+
+def research_failed(result: Optional[str]) -> bool:
+    """Whether a research result is the placeholder of a failed or abandoned subtask."""
+    return result == RESEARCH_ERROR or result == RESEARCH_TIMEOUT
+
+
+def missing_subtasks(state: AgentState) -> List[str]:
+    """Subtasks of the query without a research result: failed, abandoned, or never reached."""
+    results = state.get("results") or {}
+    return [
+        subtask for subtask in dict.fromkeys(state.get("subtasks") or [])
+        if research_failed(results.get(subtask, RESEARCH_TIMEOUT))
+    ]
+
+
+def time_left(config: Optional[RunnableConfig], name: str = "deadline") -> Optional[float]:
+    """Seconds until the run's deadline (or research_cutoff), None when the run has none."""
+    deadline = get_configurable(config, name)
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def call_before(config: Optional[RunnableConfig], name: str, func: Callable[[], Any]) -> Any:
+    """Call func, raising TimeoutError if it hasn't returned by the run's deadline (or research_cutoff).
+    
+    The call runs on the deadline executor so the node can stop waiting for it; an abandoned
+    call still completes there (and fills the research cache) but its result is ignored.
+    """
+    remaining = time_left(config, name)
+    if remaining is None:
+        return func()
+    if remaining <= 0:
+        raise TimeoutError(f"{name} passed")
+    
+    # Keep the trace of the run in the worker thread
+    context = contextvars.copy_context()
+    future = get_configurable(config, "deadline_executor").submit(context.run, func)
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeoutError:
+        raise TimeoutError(f"{name} passed") from None
+
+
+async def acall_before(config: Optional[RunnableConfig], name: str, func: Callable[[], Awaitable]) -> Any:
+    """Async variant of call_before; the call is cancelled when the deadline passes."""
+    remaining = time_left(config, name)
+    if remaining is None:
+        return await func()
+    if remaining <= 0:
+        raise TimeoutError(f"{name} passed")
+    try:
+        return await asyncio.wait_for(func(), remaining)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"{name} passed") from None
+
+
+def record_synthesis_time(config: Optional[RunnableConfig], seconds: float) -> None:
+    """Observe the duration of a model synthesis, for the estimates of synthesis_time."""
+    latencies = get_configurable(config, "synthesis_latencies")
+    if latencies is not None:
+        latencies.observe(seconds)
+
+
+def synthesis_time(config: Optional[RunnableConfig], q: float = 0.5) -> float:
+    """Expected seconds of a model synthesis: the `q` quantile of the observed ones."""
+    latencies = get_configurable(config, "synthesis_latencies")
+    observed = latencies.quantile(q) if latencies is not None else None
+    return observed if observed is not None else DEFAULT_SYNTHESIS_SECONDS
+
+
+def research_cache_key(subtask: str, config: Optional[RunnableConfig]) -> str:
+    """Cache key for a subtask: its normalized text plus the research model profile."""
+    profiles = get_configurable(config, "profiles") or default_profiles()
+    return make_key(normalize_text(subtask), profiles.fingerprint("research"))
+
+
+def is_simple_query(query: str, config: Optional[RunnableConfig]) -> bool:
+    """Whether the run's classifier sends the query straight to a single research call."""
+    classifier = get_configurable(config, "classifier")
+    if classifier is None or not classifier.is_simple(query):
+        return False
+    
+    FAST_PATHS.inc(step="decompose")
+    current = current_span()
+    if current is not None:
+        current.set(fast_path=True)
+    return True
+
+
+def direct_answer(state: AgentState) -> Optional[str]:
+    """The research result itself, when a fast-path query was answered by one research call."""
+    results = state.get("results", {})
+    if not state.get("fast_path") or len(results) != 1:
+        return None
+    
+    result = next(iter(results.values()))
+    if research_failed(result):
+        return None
+    
+    FAST_PATHS.inc(step="synthesize")
+    current = current_span()
+    if current is not None:
+        current.set(fast_path=True)
+    return result
+
+
+def prefetch_research(subtask: str, config: Optional[RunnableConfig], parent: Optional[Span]) -> str:
+    """fetch_research for a subtask streamed by decompose, traced under the decompose span."""
+    with attach(parent):
+        return fetch_research(subtask, config)
+
+
+async def aprefetch_research(subtask: str, config: Optional[RunnableConfig], parent: Optional[Span]) -> str:
+    """Async variant of prefetch_research."""
+    with attach(parent):
+        return await afetch_research(subtask, config)
+
+
+def known_subtasks(subtasks: List[str], known: Dict[str, str]) -> List[str]:
+    """Spell subtasks already researched earlier in the conversation as they were then."""
+    if not known:
+        return subtasks
+    spellings = {normalize_text(subtask): subtask for subtask in known}
+    return [spellings.get(normalize_text(subtask), subtask) for subtask in subtasks]
+
+
+def stream_subtasks(config: Optional[RunnableConfig], query: str, history: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Stream the decompose response, starting the research of each subtask as soon as it is complete."""
+    prefetch = get_configurable(config, "research_prefetch")
+    executor = get_configurable(config, "prefetch_executor")
+    known = (history or {}).get("results") or {}
+    parent = current_span()
+    parser = StringArrayParser()
+    chunks = []
+    for chunk in stream_llm(config, "decompose", decompose_prompt(query, history)):
+        chunks.append(chunk)
+        for subtask in known_subtasks(parser.feed(chunk), known):
+            if subtask not in prefetch and subtask not in known:
+                # Keep the trace of the run in the worker thread
+                context = contextvars.copy_context()
+                prefetch[subtask] = executor.submit(context.run, prefetch_research, subtask, config, parent)
+    return parse_subtasks("".join(chunks), query)
+
+
+async def astream_subtasks(
+    config: Optional[RunnableConfig],
+    query: str,
+    history: Optional[Dict[str, Any]] = None
+) -> List[str]:
+    """Async variant of stream_subtasks."""
+    prefetch = get_configurable(config, "research_prefetch")
+    known = (history or {}).get("results") or {}
+    parent = current_span()
+    parser = StringArrayParser()
+    chunks = []
+    async for chunk in astream_llm(config, "decompose", decompose_prompt(query, history)):
+        chunks.append(chunk)
+        for subtask in known_subtasks(parser.feed(chunk), known):
+            if subtask not in prefetch and subtask not in known:
+                prefetch[subtask] = asyncio.ensure_future(aprefetch_research(subtask, config, parent))
+    return parse_subtasks("".join(chunks), query)
+
+
+def decompose(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Break down the query into subtasks.
+    
+    A follow-up starts from the research of its conversation: only new subtasks are asked
+    for, and the ones researched before are skipped by route and dispatch. With a deadline,
+    a decomposition still running at the research cutoff falls back to the query itself.
+    """
+    query = state["query"]
+    history = state.get("history")
+    known = (history or {}).get("results") or {}
+    callbacks = get_callbacks(config)
+    
+    if "on_decompose_start" in callbacks:
+        callbacks["on_decompose_start"]()
+    
+    # Simple queries are researched as they are, without a model call (not follow-ups,
+    # which only make sense with the conversation)
+    fast_path = not history and is_simple_query(query, config)
+    try:
+        if fast_path:
             subtasks = [query]
+        elif get_configurable(config, "research_prefetch") is not None:
+            # Overlap decomposition and research
+            subtasks = call_before(config, "research_cutoff", lambda: stream_subtasks(config, query, history))
+        else:
+            # Generate content
+            response = call_before(
+                config, "research_cutoff", lambda: call_llm(config, "decompose", decompose_prompt(query, history))
+            )
+            
+            # Parse the response
+            subtasks = parse_subtasks(response.text, query)
         
-    except Exception:
+    except Exception as e:
         # Simple fallback
+        record_fallback("decompose", e)
         subtasks = [query]
+    subtasks = known_subtasks(subtasks, known)
+    
+    if "on_subtasks" in callbacks:
+        callbacks["on_subtasks"](subtasks)
+    
+    # Only return the updated fields (None clears the results of an earlier query of the thread)
+    return {"subtasks": subtasks, "results": dict(known) or None, "fast_path": fast_path, "cursor": 0}
+
+
+async def adecompose(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Async variant of decompose."""
+    query = state["query"]
+    history = state.get("history")
+    known = (history or {}).get("results") or {}
+    callbacks = get_callbacks(config)
     
-    # Update the state
-    new_state = state.copy()
-    new_state["subtasks"] = subtasks
-    new_state["results"] = {}
+    if "on_decompose_start" in callbacks:
+        callbacks["on_decompose_start"]()
+    
+    fast_path = not history and is_simple_query(query, config)
+    try:
+        if fast_path:
+            subtasks = [query]
+        elif get_configurable(config, "research_prefetch") is not None:
+            subtasks = await acall_before(config, "research_cutoff", lambda: astream_subtasks(config, query, history))
+        else:
+            response = await acall_before(
+                config, "research_cutoff", lambda: acall_llm(config, "decompose", decompose_prompt(query, history))
+            )
+            
+            subtasks = parse_subtasks(response.text, query)
+        
+    except Exception as e:
+        record_fallback("decompose", e)
+        subtasks = [query]
+    subtasks = known_subtasks(subtasks, known)
     
     if "on_subtasks" in callbacks:
         callbacks["on_subtasks"](subtasks)
     
-    return new_state
+    return {"subtasks": subtasks, "results": dict(known) or None, "fast_path": fast_path, "cursor": 0}
 
 
-def route(state: AgentState) -> AgentState:
-    """Determine the next subtask to process."""
-    new_state = state.copy()
-    subtasks = state.get("subtasks", [])
-    results = state.get("results", {})
+def route(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Determine the next subtask to process.
+    
+    The cursor only moves forward, so each hop is amortized O(1) instead of a scan of every subtask.
+    Once the research cutoff of a run with a deadline has passed, the remaining subtasks are skipped.
+    """
+    subtasks = state.get("subtasks") or []
+    results = state.get("results") or {}
+    cursor = state.get("cursor") or 0
     
-    # Find any unprocessed subtask
-    for subtask in subtasks:
-        if subtask not in results:
-            new_state["current_subtask"] = subtask
-            return new_state
+    if time_left(config, "research_cutoff") == 0:
+        return {"current_subtask": None, "cursor": len(subtasks)}
+    
+    # Skip the subtasks already researched (repeated subtasks, or results kept by a resumed run)
+    while cursor < len(subtasks) and subtasks[cursor] in results:
+        cursor += 1
+    
+    if cursor < len(subtasks):
+        return {"current_subtask": subtasks[cursor], "cursor": cursor}
     
     # No more subtasks to process
-    new_state["current_subtask"] = None
-    return new_state
+    return {"current_subtask": None, "cursor": cursor}
+
+
+def dispatch(state: AgentState):
+    """Fan out every unprocessed subtask to its own research node."""
+    from langgraph.types import Send
+    
+    subtasks = state.get("subtasks") or []
+    results = state.get("results", {})
+    
+    # One Send per pending subtask, all executed in the same step, carrying only the subtask
+    sends = [
+        Send("research", {"current_subtask": subtask})
+        for subtask in dict.fromkeys(subtasks)
+        if subtask not in results
+    ]
+    
+    return sends or "synthesize"
+
+
+def fetch_research(subtask: str, config: Optional[RunnableConfig]) -> str:
+    """Research a subtask: from the cache, by joining an identical call in flight, or with the model."""
+    # Reuse a fresh cached answer to the same subtask if there is one
+    cache = get_configurable(config, "research_cache")
+    flights = get_configurable(config, "research_flights")
+    cache_key = research_cache_key(subtask, config)
+    result = cache.get(cache_key) if cache is not None else None
+    record_cache_lookup("research", result is not None)
+    if result is not None:
+        return result
+    
+    def generate(_callbacks=None) -> str:
+        # Generate with search capability, with a deadline and a duplicate call if it is slow
+        prompt = research_prompt(subtask)
+        hedger = get_configurable(config, "research_hedger")
+        if hedger is not None:
+            result = hedger.call(lambda: call_llm(config, "research", prompt), "research").text
+        else:
+            result = call_llm(config, "research", prompt).text
+        
+        if cache is not None:
+            cache.set(cache_key, result)
+        return result
+    
+    # Share a single Gemini call between concurrent research of the same subtask
+    return flights.do(cache_key, generate) if flights is not None else generate()
 
 
-def research(state: AgentState) -> AgentState:
+async def afetch_research(subtask: str, config: Optional[RunnableConfig]) -> str:
+    """Async variant of fetch_research."""
+    cache = get_configurable(config, "research_cache")
+    flights = get_configurable(config, "async_research_flights")
+    cache_key = research_cache_key(subtask, config)
+    result = await off_loop(cache, cache.get, cache_key) if cache is not None else None
+    record_cache_lookup("research", result is not None)
+    if result is not None:
+        return result
+    
+    async def generate(_callbacks=None) -> str:
+        prompt = research_prompt(subtask)
+        hedger = get_configurable(config, "research_hedger")
+        if hedger is not None:
+            response = await hedger.acall(lambda: acall_llm(config, "research", prompt), "research")
+        else:
+            response = await acall_llm(config, "research", prompt)
+        
+        if cache is not None:
+            await off_loop(cache, cache.set, cache_key, response.text)
+        return response.text
+    
+    return await flights.do(cache_key, generate) if flights is not None else await generate()
+
+
+def research(state: AgentState, config: RunnableConfig = None) -> AgentState:
     """Process the current subtask using Gemini with search."""
-    new_state = state.copy()
     current_subtask = state.get("current_subtask")
-    callbacks = state.get("callbacks", {})
+    callbacks = get_callbacks(config)
     
     # Skip if there's no current subtask or if it's already been processed
     if not current_subtask or current_subtask in state.get("results", {}):
-        new_state["current_subtask"] = None
-        return new_state
+        return {}
     
     if "on_task_start" in callbacks:
         callbacks["on_task_start"](current_subtask)
     
     try:
-        # Get model config
-        model_id, generate_config = get_model_config()
-        
-        # Enhanced prompt that will trigger search
-        prompt = f"""
-        {current_subtask}
-        
-        Research this question thoroughly and provide a detailed, accurate answer with facts and specific information.
-        Include relevant recent developments on this topic.
-        """
-        
-        # Create the content
-        contents = [
-            types.Content(
-                role="user",
-                parts=[types.Part.from_text(text=prompt)]
-            )
-        ]
-        
-        # Generate with search capability
-        response = genai_client.models.generate_content(
-            model=model_id,
-            contents=contents,
-            config=generate_config
-        )
-        
-        # Get the response text
-        result = response.candidates[0].content.parts[0].text.strip()
+        # Research started while decompose was still streaming is joined
+        prefetched = (get_configurable(config, "research_prefetch") or {}).get(current_subtask)
+        if prefetched is not None:
+            result = prefetched.result(timeout=time_left(config, "research_cutoff"))
+        else:
+            # With a deadline, the subtask is abandoned at the research cutoff
+            result = call_before(config, "research_cutoff", lambda: fetch_research(current_subtask, config))
         
-    except Exception:
+    except Exception as e:
         # Simple error message
-        result = "I couldn't retrieve information for this subtask due to a technical issue."
+        record_fallback("research", e)
+        result = RESEARCH_TIMEOUT if isinstance(e, (TimeoutError, FutureTimeoutError)) else RESEARCH_ERROR
+    
+    if "on_task_complete" in callbacks:
+        callbacks["on_task_complete"](current_subtask, result)
+    
+    # Only return the new result, the reducer merges it into the state
+    return {"results": {current_subtask: result}}
+
+
+async def aresearch(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Async variant of research."""
+    current_subtask = state.get("current_subtask")
+    callbacks = get_callbacks(config)
     
-    # Store the result
-    results = new_state.get("results", {})
-    results[current_subtask] = result
-    new_state["results"] = results
+    if not current_subtask or current_subtask in state.get("results", {}):
+        return {}
+    
+    if "on_task_start" in callbacks:
+        callbacks["on_task_start"](current_subtask)
+    
+    try:
+        prefetched = (get_configurable(config, "research_prefetch") or {}).get(current_subtask)
+        if prefetched is not None:
+            result = await acall_before(config, "research_cutoff", lambda: prefetched)
+        else:
+            result = await acall_before(config, "research_cutoff", lambda: afetch_research(current_subtask, config))
+        
+    except Exception as e:
+        record_fallback("research", e)
+        result = RESEARCH_TIMEOUT if isinstance(e, TimeoutError) else RESEARCH_ERROR
     
     if "on_task_complete" in callbacks:
         callbacks["on_task_complete"](current_subtask, result)
     
-    return new_state
+    return {"results": {current_subtask: result}}
+
+
+def compress(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Cut the research results down to the sentences that matter, without a model call.
+    
+    The evidence keeps about `compression_ratio` of the research tokens (see compress_results),
+    so the synthesis prompt and its latency stop growing with the length of the results.
+    """
+    # A fast-path query is answered by its research result as it is
+    if state.get("fast_path"):
+        return {"evidence": None, "compression": None}
+    
+    start = time.perf_counter()
+    results = state.get("results") or {}
+    ratio = get_configurable(config, "compression_ratio")
+    # Failed research is kept as it is, synthesize reports the missing information
+    usable = {subtask: result for subtask, result in results.items() if not research_failed(result)}
+    evidence = {**results, **compress_results(state["query"], usable, ratio)}
+    
+    tokens_in = sum(estimate_tokens(result) for result in results.values())
+    tokens_out = sum(estimate_tokens(result) for result in evidence.values())
+    compression = {
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "ratio": round(tokens_out / tokens_in, 4) if tokens_in else 1.0,
+        "seconds": round(time.perf_counter() - start, 6),
+    }
+    COMPRESSION_RATIO.observe(compression["ratio"])
+    current = current_span()
+    if current is not None:
+        current.set(**{f"compression_{name}": value for name, value in compression.items()})
+    
+    return {"evidence": evidence, "compression": compression}
+
 
+async def acompress(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Async variant of compress, run on a worker thread to keep the event loop free."""
+    return await asyncio.to_thread(compress, state, config)
 
-def synthesize(state: AgentState) -> AgentState:
+
+def synthesize(state: AgentState, config: RunnableConfig = None) -> AgentState:
     """Generate the final answer based on subtask results."""
-    new_state = state.copy()
     query = state["query"]
     results = state.get("results", {})
-    callbacks = state.get("callbacks", {})
+    # Compressed results when the compress node ran
+    evidence = state.get("evidence") or results
+    callbacks = get_callbacks(config)
     
     if "on_synthesize_start" in callbacks:
         callbacks["on_synthesize_start"]()
     
+    degraded = False
+    missing = missing_subtasks(state)
     try:
-        # Prepare the context from the results
-        context_parts = []
-        for subtask, result in results.items():
-            # Limit length to keep context manageable
-            truncated_result = result[:1500]
-            context_parts.append(f"Context for '{subtask}':\n{truncated_result}")
-        
-        context = "\n\n".join(context_parts)
+        # A single research result already answers a simple query
+        final_answer = direct_answer(state)
+        if final_answer is not None:
+            if "on_answer_token" in callbacks:
+                callbacks["on_answer_token"](final_answer)
+        else:
+            # Too little time left before the deadline for a model synthesis
+            remaining = time_left(config)
+            if remaining is not None and remaining < synthesis_time(config):
+                raise TimeoutError(f"{remaining:.3f}s left before the deadline")
+            
+            token_budget = get_configurable(config, "context_token_budget") or DEFAULT_CONTEXT_TOKENS
+            prompt = synthesize_prompt(query, evidence, token_budget, state.get("history"), missing)
+            
+            start = time.perf_counter()
+            if "on_answer_token" in callbacks:
+                # Stream the answer so callers can show it as it is written
+                abandoned = threading.Event()
+                
+                def stream_answer() -> str:
+                    chunks = []
+                    for chunk in stream_llm(config, "synthesize", prompt):
+                        # No more tokens once the run has fallen back at its deadline
+                        if abandoned.is_set():
+                            break
+                        chunks.append(chunk)
+                        callbacks["on_answer_token"](chunk)
+                    return "".join(chunks).strip()
+                
+                try:
+                    final_answer = call_before(config, "deadline", stream_answer)
+                finally:
+                    abandoned.set()
+            else:
+                # Generate content
+                final_answer = call_before(config, "deadline", lambda: call_llm(config, "synthesize", prompt)).text
+            record_synthesis_time(config, time.perf_counter() - start)
         
-        # Get model config
-        model_id, generate_config = get_model_config()
+    except Exception as e:
+        # Simple fallback
+        record_fallback("synthesize", e)
+        final_answer = fallback_answer(query, results, missing)
+        degraded = True
+        if "on_answer_degraded" in callbacks:
+            callbacks["on_answer_degraded"]()
+    
+    if "on_answer_complete" in callbacks:
+        callbacks["on_answer_complete"](final_answer)
+    
+    return {"final_answer": final_answer, "degraded": degraded}
+
+
+async def asynthesize(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Async variant of synthesize."""
+    query = state["query"]
+    results = state.get("results", {})
+    evidence = state.get("evidence") or results
+    callbacks = get_callbacks(config)
+    
+    if "on_synthesize_start" in callbacks:
+        callbacks["on_synthesize_start"]()
+    
+    degraded = False
+    missing = missing_subtasks(state)
+    try:
+        final_answer = direct_answer(state)
+        if final_answer is not None:
+            if "on_answer_token" in callbacks:
+                callbacks["on_answer_token"](final_answer)
+        else:
+            remaining = time_left(config)
+            if remaining is not None and remaining < synthesis_time(config):
+                raise TimeoutError(f"{remaining:.3f}s left before the deadline")
+            
+            token_budget = get_configurable(config, "context_token_budget") or DEFAULT_CONTEXT_TOKENS
+            prompt = synthesize_prompt(query, evidence, token_budget, state.get("history"), missing)
+            
+            start = time.perf_counter()
+            if "on_answer_token" in callbacks:
+                async def stream_answer() -> str:
+                    chunks = []
+                    async for chunk in astream_llm(config, "synthesize", prompt):
+                        chunks.append(chunk)
+                        callbacks["on_answer_token"](chunk)
+                    return "".join(chunks).strip()
+                
+                # Cancelled at the deadline, so no token follows the fallback
+                final_answer = await acall_before(config, "deadline", stream_answer)
+            else:
+                final_answer = (await acall_before(config, "deadline", lambda: acall_llm(config, "synthesize", prompt))).text
+            record_synthesis_time(config, time.perf_counter() - start)
         
-        # Using the user-provided prompt format
-        prompt = f"""
-        Given a user question and some context, please write a clean, concise and accurate answer to the question based on the context. You will be given a set of related contexts to the question. Please use the context when crafting your answer.
+    except Exception as e:
+        record_fallback("synthesize", e)
+        final_answer = fallback_answer(query, results, missing)
+        degraded = True
+        if "on_answer_degraded" in callbacks:
+            callbacks["on_answer_degraded"]()
+    
+    if "on_answer_complete" in callbacks:
+        callbacks["on_answer_complete"](final_answer)
+    
+    return {"final_answer": final_answer, "degraded": degraded}
 
-        Your answer must be correct, accurate and written by an expert using an unbiased and professional tone. Please limit to 1024 tokens. Do not give any information that is not related to the question, and do not repeat. Say "information is missing on" followed by the related topic, if the given context do not provide sufficient information.
 
-        Here are the set of contexts:
-        {context}
+def replay_progress(callbacks: Dict[str, Callable], subtasks: Optional[List[str]], results: Dict[str, str]) -> None:
+    """Fire the callbacks of the decompose and research steps already done by an earlier run."""
+    if subtasks is None:
+        return
+    
+    if "on_decompose_start" in callbacks:
+        callbacks["on_decompose_start"]()
+    
+    if "on_subtasks" in callbacks:
+        callbacks["on_subtasks"](subtasks)
+    
+    for subtask, result in results.items():
+        if "on_task_start" in callbacks:
+            callbacks["on_task_start"](subtask)
+        if "on_task_complete" in callbacks:
+            callbacks["on_task_complete"](subtask, result)
 
-        Remember, don't blindly repeat the contexts verbatim and don't tell the user how you used the citations – just respond with the answer. It is very important for my career that you follow these instructions. Here is the user question: {query}
-        """
-        
-        # Create the content
-        contents = [
-            types.Content(
-                role="user",
-                parts=[types.Part.from_text(text=prompt)]
+
+def replay_callbacks(callbacks: Dict[str, Callable], cached: Dict) -> None:
+    """Fire the callbacks of a full run for an answer served from the cache."""
+    replay_progress(callbacks, cached["subtasks"], cached["results"])
+    
+    if "on_synthesize_start" in callbacks:
+        callbacks["on_synthesize_start"]()
+    
+    if "on_answer_token" in callbacks:
+        callbacks["on_answer_token"](cached["final_answer"])
+    
+    if "on_answer_complete" in callbacks:
+        callbacks["on_answer_complete"](cached["final_answer"])
+
+
+def plan_thread(query: str, snapshot: StateSnapshot) -> Tuple[str, Dict[str, str]]:
+    """Decide how a run continues the checkpointed thread it was given.
+    
+    Returns the action and the research results to keep: "start" the query from scratch,
+    "resume" an interrupted run after its last completed node, "retry" the failed research
+    and synthesis of a degraded run, or "done" when the thread already answered the query.
+    """
+    values = snapshot.values or {}
+    if values.get("query") != query:
+        return "start", {}
+    
+    # Research nodes that completed in the interrupted step are not run again
+    results = dict(values.get("results") or {})
+    for task in snapshot.tasks:
+        results.update((task.result or {}).get("results") or {})
+    
+    if snapshot.next:
+        return "resume", results
+    if not values.get("final_answer"):
+        return "start", {}
+    
+    succeeded = {subtask: result for subtask, result in results.items() if not research_failed(result)}
+    if values.get("degraded") or len(succeeded) < len(results) or missing_subtasks(values):
+        return "retry", succeeded
+    return "done", results
+
+
+def instrument_node(node: str, func: Callable, afunc: Callable) -> RunnableCallable:
+    """Wrap a node so each execution is timed and recorded as a span."""
+    def run_node(state: AgentState, config: RunnableConfig = None) -> AgentState:
+        with span(node, subtask=state.get("current_subtask")), NODE_SECONDS.time(node=node):
+            return func(state, config)
+    
+    async def arun_node(state: AgentState, config: RunnableConfig = None) -> AgentState:
+        with span(node, subtask=state.get("current_subtask")), NODE_SECONDS.time(node=node):
+            return await afunc(state, config)
+    
+    from langgraph.utils.runnable import RunnableCallable
+    
+    # LangGraph's own node wrapper inspects the signature once, RunnableLambda on every call
+    return RunnableCallable(run_node, arun_node, name=node)
+
+
+def serialize_callbacks(callbacks: Mapping[str, Callable]) -> Mapping[str, Callable]:
+    """Wrap callbacks so parallel research nodes never invoke them concurrently."""
+    # A shared run's flight already serializes its events, and its callbacks must stay live
+    if isinstance(callbacks, FlightCallbacks):
+        return callbacks
+    lock = threading.Lock()
+    
+    def wrap(callback: Callable) -> Callable:
+        def locked(*args, **kwargs):
+            with lock:
+                return callback(*args, **kwargs)
+        return locked
+    
+    return {name: wrap(callback) for name, callback in callbacks.items()}
+
+
+class PerplexityAgent:
+    """A simple agent that uses Gemini (or any LLMBackend) to process queries."""
+    
+    def __init__(
+        self,
+        parallel: bool = True,
+        max_concurrency: Optional[int] = None,
+        research_cache_size: int = 1024,
+        research_cache_ttl: Optional[float] = 3600,
+        answer_cache_size: int = 100_000,
+        answer_cache_ttl: Optional[float] = 600,
+        answer_cache_threshold: float = 0.8,
+        profiles: Optional[ProfileRegistry] = None,
+        backend: Optional[LLMBackend] = None,
+        context_token_budget: int = DEFAULT_CONTEXT_TOKENS,
+        compression_ratio: Optional[float] = None,
+        fast_path: bool = True,
+        stream_decompose: bool = True,
+        research_deadline: Optional[float] = 60.0,
+        hedge_quantile: Optional[float] = 0.9,
+        hedge_budget: float = 0.1,
+        checkpointer: Optional[BaseCheckpointSaver] = None,
+        checkpoint_path: Optional[str] = None,
+        shared_cache_path: Optional[str] = None,
+        conversation_size: int = 10_000,
+        conversation_ttl: Optional[float] = 3600,
+        max_memory_threads: int = 1000
+    ):
+        # Per-node model settings, PERPLEXITY_<NODE>_MODEL etc. override the defaults
+        self.profiles = profiles or default_profiles()
+        # Model calls go through this backend (Gemini, or the local simulator)
+        self.backend = backend or default_backend()
+        # Approximate number of research tokens packed into the synthesis prompt
+        self.context_token_budget = context_token_budget
+        # Share of the research tokens kept by the local compress node before synthesis
+        # (extractive, no model call); None leaves the results as they are
+        self.compression_ratio = compression_ratio
+        # Simple queries skip decompose, and synthesize when one research call answers them
+        self.classifier = QueryClassifier() if fast_path else None
+        # Research all subtasks at once, or one after another through route
+        self.parallel = parallel
+        # In parallel mode, research each subtask as soon as decompose has streamed it
+        # (prefetched research would bypass max_concurrency, so not when it is set)
+        self.stream_decompose = stream_decompose and parallel and not max_concurrency
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="research")
+        # Upper bound on simultaneous research calls (None means no limit)
+        self.max_concurrency = max_concurrency
+        # Research results shared by every query (a size of 0 disables caching)
+        self.research_cache = TTLCache(max_size=research_cache_size, ttl=research_cache_ttl)
+        # Final answers, also served to rephrasings of a cached query (a size of 0 disables caching)
+        self.answer_cache = NearDuplicateCache(
+            threshold=answer_cache_threshold,
+            ttl=answer_cache_ttl,
+            max_entries=answer_cache_size,
+            # Answers depend on every model profile (research keys already include theirs)
+            shared=self._shared_cache(
+                shared_cache_path,
+                "answer:" + make_key(*(self.profiles.fingerprint(node) for node in sorted(self.profiles.profiles)))[:16],
+                answer_cache_size,
+                answer_cache_ttl
             )
-        ]
-        
-        # Generate content
-        response = genai_client.models.generate_content(
-            model=model_id,
-            contents=contents,
-            config=generate_config
         )
+        # Both caches are backed by the SQLite file at shared_cache_path when given, shared by
+        # every process of the host so the hit rate doesn't divide across worker processes
+        shared_research = self._shared_cache(shared_cache_path, "research", research_cache_size, research_cache_ttl)
+        if shared_research is not None:
+            self.research_cache = TieredCache(self.research_cache, shared_research)
+        # Concurrent identical queries, and identical subtasks, share one execution
+        self.query_flights = SingleFlight(CALLBACK_NAMES)
+        self.async_query_flights = AsyncSingleFlight(CALLBACK_NAMES)
+        self.research_flights = SingleFlight()
+        self.async_research_flights = AsyncSingleFlight()
+        # Research calls slower than the observed hedge_quantile latency get one duplicate call
+        # (at most hedge_budget extra calls per call), and fail after research_deadline seconds
+        self.research_hedger = Hedger(deadline=research_deadline, quantile=hedge_quantile, budget=hedge_budget)
+        # Durations of the model syntheses, to know how much of a run's deadline to keep for synthesis
+        self.synthesis_latencies = LatencyTracker()
         
-        final_answer = response.candidates[0].content.parts[0].text.strip()
+        # Earlier turns and research of the conversations given a conversation_id, so
+        # follow-up queries only research what is new
+        self.conversations = ConversationStore(max_conversations=conversation_size, ttl=conversation_ttl)
         
-    except Exception:
-        # Simple fallback
-        final_answer = f"# Answer to: {query}\n\n"
-        final_answer += "Based on the information gathered:\n\n"
+        # State of the runs given a thread_id, saved after every node so they can be resumed
+        # (in memory unless a persistent checkpointer such as SQLiteCheckpointer is given, or
+        # a checkpoint_path where a SQLiteCheckpointer is opened with the graph)
+        self.checkpointer = checkpointer
+        self.checkpoint_path = checkpoint_path
+        # (a checkpointer given by the caller is assumed to be persistent)
+        self.persistent_checkpoints = checkpointer is not None or checkpoint_path is not None
+        # In memory, only the max_memory_threads most recently used threads are kept
+        self.max_memory_threads = max_memory_threads
+        self._threads: "OrderedDict[str, None]" = OrderedDict()
+        self._threads_lock = threading.Lock()
         
-        # Add a summary of each result
-        for subtask, result in results.items():
-            first_paragraph = result.split("\n")[0]
-            final_answer += f"- **{subtask}**: {first_paragraph}\n\n"
+        # The workflow is built and compiled on first use (or by warm_up), not at construction
+        self._graphs: Optional[Tuple[Any, Any]] = None
+        self._graphs_lock = threading.Lock()
     
-    new_state["final_answer"] = final_answer
+    def _compile(self) -> Tuple[Any, Any]:
+        """Build the workflow and compile it without and with the checkpointer, once."""
+        graphs = self._graphs
+        if graphs is None:
+            with self._graphs_lock:
+                graphs = self._graphs
+                if graphs is None:
+                    from langgraph.checkpoint.memory import MemorySaver
+                    
+                    if self.checkpointer is None and self.checkpoint_path:
+                        from checkpoint import SQLiteCheckpointer
+                        
+                        self.checkpointer = SQLiteCheckpointer.from_path(self.checkpoint_path)
+                    elif self.checkpointer is None:
+                        self.checkpointer = MemorySaver()
+                    self.workflow = self._build_workflow()
+                    graphs = self._graphs = (
+                        self.workflow.compile(),
+                        self.workflow.compile(checkpointer=self.checkpointer)
+                    )
+        return graphs
     
-    if "on_answer_complete" in callbacks:
-        callbacks["on_answer_complete"](final_answer)
+    @property
+    def app(self):
+        """The compiled graph."""
+        return self._compile()[0]
     
-    return new_state
-
-
-class PerplexityAgent:
-    """A simple agent that uses Gemini to process queries."""
+    @property
+    def durable_app(self):
+        """The compiled graph checkpointing runs given a thread_id."""
+        return self._compile()[1]
+    
+    def warm_up(self) -> None:
+        """Do the one-time setup of the first query now: graph, model configs and backend client.
+        
+        This imports LangGraph and google-genai, so call it off the request path (e.g. at startup).
+        """
+        self._compile()
+        self.profiles.build_all()
+        self.backend.warm_up()
     
-    def __init__(self):
-        # Set up the workflow
-        self.workflow = self._build_workflow()
-        self.app = self.workflow.compile()
+    def _shared_cache(self, path: Optional[str], namespace: str, size: int, ttl: Optional[float]) -> Optional[SQLiteCache]:
+        """The cross-process tier of a cache, None unless a path is given and caching is enabled."""
+        if not path or size <= 0:
+            return None
+        return SQLiteCache(path, namespace=namespace, ttl=ttl)
     
     def _build_workflow(self) -> StateGraph:
         """Build the workflow graph."""
+        from langgraph.graph import END, StateGraph, START
+        from langgraph.utils.runnable import RunnableCallable
+        
         # Initialize the graph
         workflow = StateGraph(AgentState)
         
-        # Add nodes for each step
-        workflow.add_node("decompose", decompose)
-        workflow.add_node("route", route)
-        workflow.add_node("research", research)
-        workflow.add_node("synthesize", synthesize)
+        # Add nodes for each step (sync for invoke, async for ainvoke), timed and traced
+        self.nodes = {
+            "decompose": instrument_node("decompose", decompose, adecompose),
+            "research": instrument_node("research", research, aresearch),
+            "synthesize": instrument_node("synthesize", synthesize, asynthesize)
+        }
+        if self.compression_ratio is not None:
+            self.nodes["compress"] = instrument_node("compress", compress, acompress)
+        for name, node in self.nodes.items():
+            workflow.add_node(name, node)
         
         # Define the edges
         workflow.add_edge(START, "decompose")
-        workflow.add_edge("decompose", "route")
-        
-        # Routing logic
-        workflow.add_conditional_edges(
-            "route",
-            lambda state: "synthesize" if state["current_subtask"] is None else "research",
-            {
-                "synthesize": "synthesize",
-                "research": "research"
-            }
-        )
         
-        workflow.add_edge("research", "route")
+        # Research results go through compress first, when enabled
+        after_research = "compress" if "compress" in self.nodes else "synthesize"
+        if after_research == "compress":
+            workflow.add_edge("compress", "synthesize")
+        
+        if self.parallel:
+            # Fan out to one research node per subtask, then join in synthesize
+            workflow.add_conditional_edges(
+                "decompose",
+                dispatch,
+                {"research": "research", "synthesize": after_research}
+            )
+            workflow.add_edge("research", after_research)
+        else:
+            # (wrapped by LangGraph's node wrapper to get the run config, like the other nodes)
+            workflow.add_node("route", RunnableCallable(route, name="route"))
+            workflow.add_edge("decompose", "route")
+            
+            # Routing logic
+            workflow.add_conditional_edges(
+                "route",
+                lambda state: "synthesize" if state["current_subtask"] is None else "research",
+                {
+                    "synthesize": after_research,
+                    "research": "research"
+                }
+            )
+            
+            workflow.add_edge("research", "route")
+        
         workflow.add_edge("synthesize", END)
         
         return workflow
     
-    def run(self, query: str, callbacks: Optional[Dict[str, Callable]] = None) -> str:
-        """Run the agent to process a query and return the answer."""
-        try:
-            # Initialize the state
-            state = {
-                "query": query,
-                "results": {},
-                "callbacks": callbacks or {}
+    def _run_config(
+        self,
+        callbacks: Optional[Dict[str, Callable]] = None,
+        thread_id: Optional[str] = None,
+        prefetch: bool = True,
+        deadline: Optional[float] = None
+    ) -> Dict:
+        """Build the LangGraph run configuration.
+        
+        With a deadline (a time.monotonic() value), research stops at a cutoff leaving the
+        expected (90th percentile) synthesis time and DEADLINE_MARGIN before the deadline, or
+        at the deadline itself when the run is too short for a model synthesis anyway.
+        """
+        config = {
+            "configurable": {
+                # Not `callbacks or {}`: a shared run's callbacks may be empty until a subscriber joins
+                "callbacks": serialize_callbacks(callbacks if callbacks is not None else {}),
+                "backend": self.backend,
+                "profiles": self.profiles,
+                "context_token_budget": self.context_token_budget,
+                "compression_ratio": self.compression_ratio,
+                "classifier": self.classifier,
+                "research_cache": self.research_cache,
+                "research_flights": self.research_flights,
+                "async_research_flights": self.async_research_flights,
+                "research_hedger": self.research_hedger,
+                "synthesis_latencies": self.synthesis_latencies
             }
+        }
+        if deadline is not None:
+            reserve = (self.synthesis_latencies.quantile(0.9) or DEFAULT_SYNTHESIS_SECONDS) + DEADLINE_MARGIN
+            cutoff = deadline - reserve
+            config["configurable"]["deadline"] = deadline
+            config["configurable"]["research_cutoff"] = cutoff if cutoff > time.monotonic() else deadline
+            config["configurable"]["deadline_executor"] = self.prefetch_executor
+        if thread_id is not None:
+            config["configurable"]["thread_id"] = str(thread_id)
+        if self.max_concurrency:
+            config["max_concurrency"] = self.max_concurrency
+        if not self.parallel:
+            # route and research take a step each per subtask, past the default limit of 25 steps
+            config["recursion_limit"] = SEQUENTIAL_RECURSION_LIMIT
+        if self.stream_decompose and prefetch:
+            # Research started by this run's decompose, by subtask
+            config["configurable"]["research_prefetch"] = {}
+            config["configurable"]["prefetch_executor"] = self.prefetch_executor
+        return config
+    
+    def _initial_state(self, query: str, history: Optional[Dict[str, Any]] = None) -> AgentState:
+        """Initialize the state for a new query (None clears the results of a thread's earlier query)."""
+        return {
+            "query": query,
+            "subtasks": None,
+            "results": None,
+            "current_subtask": None,
+            "cursor": None,
+            "final_answer": None,
+            "degraded": None,
+            "fast_path": None,
+            "history": history,
+            "evidence": None,
+            "compression": None
+        }
+    
+    def _cached_answer(self, query: str, callbacks: Optional[Dict[str, Callable]]) -> Optional[Dict]:
+        """Serve a query from the answer cache, replaying its callbacks."""
+        cached = self.answer_cache.get(query)
+        record_cache_lookup("answer", cached is not None)
+        if cached is None:
+            return None
+        
+        replay_callbacks(callbacks if callbacks is not None else {}, cached)
+        return cached
+    
+    async def _acached_answer(self, query: str, callbacks: Optional[Dict[str, Callable]]) -> Optional[Dict]:
+        """Async variant of _cached_answer (callbacks are still replayed on the event loop)."""
+        cached = await off_loop(self.answer_cache, self.answer_cache.get, query)
+        record_cache_lookup("answer", cached is not None)
+        if cached is None:
+            return None
+        
+        replay_callbacks(callbacks if callbacks is not None else {}, cached)
+        return cached
+    
+    def _store_answer(self, query: str, result: AgentState) -> None:
+        """Cache a complete answer unless some step fell back."""
+        results = result.get("results", {})
+        if result.get("degraded") or missing_subtasks(result):
+            return
+        
+        self.answer_cache.set(query, {
+            "final_answer": result["final_answer"],
+            "subtasks": list(result.get("subtasks") or []),
+            "results": dict(results)
+        })
+    
+    def _record_turn(self, conversation_id: Optional[str], query: str, result: Dict) -> None:
+        """Keep the answer and the successful research of a turn for the follow-ups of its conversation."""
+        if conversation_id is None:
+            return
+        results = {
+            subtask: value for subtask, value in (result.get("results") or {}).items()
+            if not research_failed(value)
+        }
+        self.conversations.record(conversation_id, query, result["final_answer"], results)
+    
+    def _use_thread(self, thread_id: str) -> None:
+        """Mark a thread as used, forgetting the least recently used ones past max_memory_threads (in memory)."""
+        if self.persistent_checkpoints:
+            return
+        with self._threads_lock:
+            self._threads[thread_id] = None
+            self._threads.move_to_end(thread_id)
+            expired = []
+            while len(self._threads) > self.max_memory_threads:
+                expired.append(self._threads.popitem(last=False)[0])
+        if self.checkpointer is not None:
+            for old in expired:
+                self.checkpointer.delete_thread(old)
+    
+    def delete_thread(self, thread_id: str) -> None:
+        """Forget the checkpoints of a thread, e.g. once the job it was kept for is finished."""
+        with self._threads_lock:
+            self._threads.pop(str(thread_id), None)
+        if self.checkpointer is not None:
+            self.checkpointer.delete_thread(str(thread_id))
+    
+    def _flight_key(self, query: str, thread_id: Optional[str], conversation_id: Optional[str]) -> Hashable:
+        """Runs sharing this key are joined.
+        
+        A run on a thread only joins runs on the same thread (each thread gets its own
+        checkpoints), and a follow-up only joins the same turn of its conversation.
+        """
+        if thread_id is None and conversation_id is None:
+            return normalize_text(query)
+        return (
+            str(thread_id) if thread_id is not None else None,
+            str(conversation_id) if conversation_id is not None else None,
+            normalize_text(query)
+        )
+    
+    def run(
+        self,
+        query: str,
+        callbacks: Optional[Dict[str, Callable]] = None,
+        trace: Optional[Trace] = None,
+        thread_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        deadline_ms: Optional[float] = None
+    ) -> str:
+        """Run the agent to process a query and return the answer.
+        
+        Pass a Trace to record the span tree of the run (nodes, model calls, cache hits); a
+        traced query runs on its own instead of joining an identical one already running.
+        With a thread_id the state is checkpointed after every node: running the same query
+        on the thread again resumes an interrupted run, or retries only the failed steps.
+        With a conversation_id the query is a follow-up of the earlier ones of the conversation:
+        it is decomposed knowing them, and only researches what they didn't already.
+        With a deadline_ms the answer comes within about that many milliseconds: research
+        still running at the cutoff is abandoned and the answer says what is missing, and it
+        is summarized locally when there is no time left for a model synthesis.
+        """
+        deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms is not None else None
+        with trace.activate() if trace else nullcontext(), QUERY_SECONDS.time(source="run"):
+            # A traced run is never joined to another one, whose spans would go to its own trace,
+            # nor is a run with a deadline (its answer may be partial, or come too late for it)
+            if trace is not None or deadline is not None:
+                return self._run(query, callbacks or {}, thread_id, conversation_id, deadline)
+            
+            # Identical queries already running are joined instead of started again
+            return self.query_flights.do(
+                self._flight_key(query, thread_id, conversation_id),
+                lambda shared_callbacks: self._run(query, shared_callbacks, thread_id, conversation_id, deadline),
+                callbacks
+            )
+    
+    async def arun(
+        self,
+        query: str,
+        callbacks: Optional[Dict[str, Callable]] = None,
+        trace: Optional[Trace] = None,
+        thread_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        deadline_ms: Optional[float] = None
+    ) -> str:
+        """Async variant of run that never blocks the event loop."""
+        deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms is not None else None
+        with trace.activate() if trace else nullcontext(), QUERY_SECONDS.time(source="arun"):
+            if trace is not None or deadline is not None:
+                return await self._arun(query, callbacks or {}, thread_id, conversation_id, deadline)
+            
+            return await self.async_query_flights.do(
+                self._flight_key(query, thread_id, conversation_id),
+                lambda shared_callbacks: self._arun(query, shared_callbacks, thread_id, conversation_id, deadline),
+                callbacks
+            )
+    
+    def _run_thread(self, query: str, config: Dict, history: Optional[Dict[str, Any]] = None) -> AgentState:
+        """Run a query on a checkpointed thread, continuing where an earlier run on it stopped."""
+        snapshot = self.durable_app.get_state(config)
+        action, results = plan_thread(query, snapshot)
+        if action == "start":
+            return self.durable_app.invoke(self._initial_state(query, history), config=config)
+        
+        callbacks = get_callbacks(config)
+        if action == "done":
+            replay_callbacks(callbacks, snapshot.values)
+            return snapshot.values
+        
+        replay_progress(callbacks, snapshot.values.get("subtasks"), results)
+        if action == "retry":
+            # Go back to the end of decompose with only the successful results, so the
+            # failed subtasks are researched again and the answer is synthesized again
+            self.durable_app.update_state(config, {"results": None}, as_node="decompose")
+            self.durable_app.update_state(config, {"results": results, "cursor": 0}, as_node="decompose")
+        
+        return self.durable_app.invoke(None, config=config)
+    
+    async def _arun_thread(self, query: str, config: Dict, history: Optional[Dict[str, Any]] = None) -> AgentState:
+        """Async variant of _run_thread."""
+        snapshot = await self.durable_app.aget_state(config)
+        action, results = plan_thread(query, snapshot)
+        if action == "start":
+            return await self.durable_app.ainvoke(self._initial_state(query, history), config=config)
+        
+        callbacks = get_callbacks(config)
+        if action == "done":
+            replay_callbacks(callbacks, snapshot.values)
+            return snapshot.values
+        
+        replay_progress(callbacks, snapshot.values.get("subtasks"), results)
+        if action == "retry":
+            await self.durable_app.aupdate_state(config, {"results": None}, as_node="decompose")
+            await self.durable_app.aupdate_state(config, {"results": results, "cursor": 0}, as_node="decompose")
+        
+        return await self.durable_app.ainvoke(None, config=config)
+    
+    def _run(
+        self,
+        query: str,
+        callbacks: Dict[str, Callable],
+        thread_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> str:
+        """Process a query with the workflow."""
+        try:
+            history = self.conversations.get(conversation_id) if conversation_id is not None else None
             
-            # Execute the workflow
-            result = self.app.invoke(state)
+            # Answer rephrasings of a recent query from the cache (follow-ups depend on their conversation)
+            cached = self._cached_answer(query, callbacks) if history is None else None
+            if cached is not None:
+                self._record_turn(conversation_id, query, cached)
+                return cached["final_answer"]
+            
+            # Execute the workflow, checkpointed when the run belongs to a thread
+            config = self._run_config(callbacks, thread_id, deadline=deadline)
+            if thread_id is not None:
+                self._use_thread(str(thread_id))
+                result = self._run_thread(query, config, history)
+            else:
+                result = self.app.invoke(self._initial_state(query, history), config=config)
             
             # Return the final answer
             if "final_answer" in result and result["final_answer"]:
+                if history is None:
+                    self._store_answer(query, result)
+                self._record_turn(conversation_id, query, result)
                 return result["final_answer"]
             
             return "Failed to generate an answer."
         
         except Exception as e:
-            return f"Error: {str(e)}" 
\ No newline at end of file
+            return f"Error: {str(e)}"
+    
+    async def _arun(
+        self,
+        query: str,
+        callbacks: Dict[str, Callable],
+        thread_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> str:
+        """Process a query with the workflow, asynchronously."""
+        try:
+            history = self.conversations.get(conversation_id) if conversation_id is not None else None
+            
+            cached = await self._acached_answer(query, callbacks) if history is None else None
+            if cached is not None:
+                self._record_turn(conversation_id, query, cached)
+                return cached["final_answer"]
+            
+            config = self._run_config(callbacks, thread_id, deadline=deadline)
+            if thread_id is not None:
+                self._use_thread(str(thread_id))
+                result = await self._arun_thread(query, config, history)
+            else:
+                result = await self.app.ainvoke(self._initial_state(query, history), config=config)
+            
+            if "final_answer" in result and result["final_answer"]:
+                if history is None:
+                    await off_loop(self.answer_cache, self._store_answer, query, result)
+                self._record_turn(conversation_id, query, result)
+                return result["final_answer"]
+            
+            return "Failed to generate an answer."
+        
+        except Exception as e:
+            return f"Error: {str(e)}"
+    
+    def run_batch(
+        self,
+        queries: List[str],
+        concurrency: int = 8,
+        similarity: float = 0.9
+    ) -> Iterator[Tuple[int, str]]:
+        """Answer a batch of queries, yielding (index, answer) pairs as they complete.
+        
+        See arun_batch; this runs it on a private event loop.
+        """
+        loop = asyncio.new_event_loop()
+        batch = self.arun_batch(queries, concurrency, similarity)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(batch.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(batch.aclose())
+            loop.close()
+    
+    async def arun_batch(
+        self,
+        queries: List[str],
+        concurrency: int = 8,
+        similarity: float = 0.9
+    ) -> AsyncIterator[Tuple[int, str]]:
+        """Answer a batch of queries, yielding (index, answer) pairs in completion order.
+        
+        Every query is decomposed first, then identical or near-identical subtasks across the
+        batch (word similarity of at least `similarity`, asking the same question, so "who founded
+        X" and "when was X founded" stay apart) are researched only once. An answer is
+        synthesized as soon as the subtasks of its query are researched. At most `concurrency`
+        node executions run at once, answers going before research so results flow early.
+        """
+        # Subtasks are only researched once the whole batch is decomposed and deduplicated
+        config = self._run_config(prefetch=False)
+        # The batch calls the nodes directly, which only exist once the graph is built
+        self._compile()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        order = itertools.count()
+        
+        def schedule(priority: int, node: str, state: AgentState) -> asyncio.Future:
+            future = loop.create_future()
+            queue.put_nowait((priority, next(order), node, state, future))
+            return future
+        
+        async def worker():
+            while True:
+                _, _, node, state, future = await queue.get()
+                try:
+                    result = await self.nodes[node].ainvoke(state, config)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+        pending: List[asyncio.Task] = []
+        try:
+            # Identical queries of the batch are answered once
+            indexes: Dict[str, List[int]] = {}
+            answers: Dict[str, asyncio.Future] = {}
+            states: Dict[str, AgentState] = {}
+            decomposed: Dict[str, asyncio.Future] = {}
+            for index, query in enumerate(queries):
+                key = normalize_text(query)
+                indexes.setdefault(key, []).append(index)
+                if key in answers:
+                    continue
+                answers[key] = loop.create_future()
+                cached = await off_loop(self.answer_cache, self.answer_cache.get, query)
+                record_cache_lookup("answer", cached is not None)
+                if cached is not None:
+                    answers[key].set_result(cached["final_answer"])
+                else:
+                    states[key] = self._initial_state(query)
+                    decomposed[key] = schedule(2, "decompose", states[key])
+            
+            # Map every subtask onto the first equivalent subtask of the batch
+            await asyncio.gather(*decomposed.values(), return_exceptions=True)
+            canonical = NearDuplicateCache(threshold=similarity, ttl=None, max_entries=1_000_000)
+            research: Dict[str, asyncio.Future] = {}
+            sources: Dict[str, Dict[str, str]] = {}
+            for key, future in decomposed.items():
+                if future.exception() is not None:
+                    answers[key].set_result(f"Error: {str(future.exception())}")
+                    continue
+                # Nodes only return the fields they update
+                states[key] = {**states[key], **future.result()}
+                sources[key] = {}
+                for subtask in states[key]["subtasks"]:
+                    match = canonical.get(subtask)
+                    # Never merge two different subtasks of the same query
+                    if match is not None and (match[0] != key or normalize_text(match[1]) == normalize_text(subtask)):
+                        sources[key][subtask] = match[1]
+                        continue
+                    canonical.set(subtask, (key, subtask))
+                    sources[key][subtask] = subtask
+                    research[subtask] = schedule(1, "research", {"current_subtask": subtask, "results": {}})
+            
+            async def synthesize_answer(key: str) -> None:
+                query = queries[indexes[key][0]]
+                try:
+                    researched = await asyncio.gather(*(research[source] for source in sources[key].values()))
+                    results = {
+                        subtask: update["results"][source]
+                        for (subtask, source), update in zip(sources[key].items(), researched)
+                    }
+                    
+                    state = {**states[key], "results": results}
+                    if "compress" in self.nodes:
+                        state = {**state, **await schedule(0, "compress", state)}
+                    result = {**state, **await schedule(0, "synthesize", state)}
+                    if result.get("final_answer"):
+                        await off_loop(self.answer_cache, self._store_answer, query, result)
+                        answers[key].set_result(result["final_answer"])
+                    else:
+                        answers[key].set_result("Failed to generate an answer.")
+                except Exception as e:
+                    answers[key].set_result(f"Error: {str(e)}")
+            
+            pending = [asyncio.create_task(synthesize_answer(key)) for key in sources]
+            
+            async def keyed(key: str) -> Tuple[str, str]:
+                return key, await answers[key]
+            
+            # Yield every query of the batch as soon as its answer is ready
+            for next_answer in asyncio.as_completed([keyed(key) for key in answers]):
+                key, final_answer = await next_answer
+                for index in indexes[key]:
+                    yield index, final_answer
+        
+        finally:
+            for task in pending + workers:
+                task.cancel()
@@ -2,6 +2,7 @@ import streamlit as st
 import os
 from dotenv import load_dotenv
 from agent import PerplexityAgent
+from query_runner import DECOMPOSE, DONE, SYNTHESIZE, QueryRunner
 
 # Load environment variables
 load_dotenv()
@@ -17,18 +18,27 @@ st.set_page_config(
 st.title("Perplexity-like Agent 🔍")
 st.markdown("##### Built with Gemini 2.0 and LangGraph")
 
-# Initialize session state for storing results and tracking process
-if 'results' not in st.session_state:
-    st.session_state.results = []
-if 'running' not in st.session_state:
-    st.session_state.running = False
-if 'final_answer' not in st.session_state:
-    st.session_state.final_answer = None
-if 'subtasks' not in st.session_state:
-    st.session_state.subtasks = []
+# Seconds between two refreshes of a running query
+POLL_SECONDS = 0.5
+
+# Initialize session state for storing the query and its run
+if 'run' not in st.session_state:
+    st.session_state.run = None
 if 'current_query' not in st.session_state:
     st.session_state.current_query = ""
 
+# Initialize the agent and the background runner shared by every session
+@st.cache_resource
+def get_runner():
+    return QueryRunner(
+        PerplexityAgent(),
+        workers=int(os.environ.get("PERPLEXITY_UI_WORKERS", 8)),
+        cache_size=int(os.environ.get("PERPLEXITY_UI_CACHE_SIZE", 1000)),
+        cache_ttl=float(os.environ.get("PERPLEXITY_UI_CACHE_TTL", 3600))
+    )
+
+runner = get_runner()
+
 # Create UI layout with a cleaner design
 
 # Create a text input for the user query
@@ -36,148 +46,112 @@ query = st.text_input("Ask me anything:", placeholder="Enter your question here.
 
 # Function to reset all results
 def reset_results():
-    st.session_state.results = []
-    st.session_state.subtasks = []
-    st.session_state.final_answer = None
-    st.session_state.running = False
+    st.session_state.run = None
 
 # Handle query submission when the query changes
 if query != st.session_state.current_query and query:
     reset_results()
     st.session_state.current_query = query
 
-# Add a dedicated "Send" button to control when the query is processed
-send_button = st.button("Send Query", type="primary", disabled=st.session_state.running or not query)
-
-# Initialize the agent
-@st.cache_resource
-def get_agent():
-    return PerplexityAgent()
+running = st.session_state.run is not None and not st.session_state.run.done
 
-agent = get_agent()
+# Add a dedicated "Send" button to control when the query is processed
+send_button = st.button("Send Query", type="primary", disabled=running or not query)
+
+# When the user clicks the Send button, start the query in the background (or get its cached answer)
+if send_button and query and not running:
+    st.session_state.run = runner.submit(query)
+    running = not st.session_state.run.done
+
+def render_subtasks(subtasks):
+    # Create a bulleted list of subtasks
+    subtasks_markdown = ""
+    for i, task in enumerate(subtasks, 1):
+        subtasks_markdown += f"**Task {i}:** {task}\n\n"
+    st.markdown(subtasks_markdown)
+
+def render_answer(progress):
+    """Final view: the answer next to the research details."""
+    if progress["error"]:
+        st.error(f"An error occurred: {progress['error']}")
+        return
+    
+    col1, col2 = st.columns([1, 1])
+    
+    with col2:
+        # Display the final answer
+        st.markdown("## Answer")
+        st.markdown(progress["answer"])
+    
+    with col1:
+        # Show the research details
+        st.markdown("## Research Details")
+        
+        # Display subtasks
+        st.markdown("### Subtasks")
+        render_subtasks(progress["subtasks"])
+        
+        # Display results for each task
+        st.markdown("### Task Results")
+        for i, (t, r) in enumerate(progress["results"], 1):
+            st.expander(f"Task {i}: {t}", expanded=False).markdown(r)
+
+# Only this fragment reruns while the query runs: the page is refreshed from the run's progress
+# without blocking the session, and without a full script run per refresh
+@st.fragment(run_every=POLL_SECONDS)
+def render_progress():
+    progress = st.session_state.run.snapshot()
+    if progress["stage"] == DONE:
+        # Show the final view
+        st.rerun()
+    
+    # Create a 2-column layout for better organization
+    col1, col2 = st.columns([1, 1])
+    
+    with col1:
+        # Create a container for the research with a better visual
+        st.subheader("Research")
+        if progress["stage"] == DECOMPOSE:
+            st.info("🔍 Breaking down your question into subtasks...")
+        elif progress["stage"] == SYNTHESIZE:
+            st.info("🔄 Synthesizing final answer...")
+        elif progress["current_task"]:
+            st.info(f"🔄 Researching: **{progress['current_task']}**")
+        else:
+            st.success("✅ Question broken down into subtasks")
+        
+        # Create a container for subtasks
+        st.markdown("### Subtasks")
+        render_subtasks(progress["subtasks"])
+        
+        # Research results as they complete
+        st.markdown("### Task Results")
+        for i, (t, r) in enumerate(progress["results"], 1):
+            st.expander(f"Task {i}: {t}", expanded=True).markdown(r)
+    
+    with col2:
+        # The answer as it is written
+        st.subheader("Answer")
+        if progress["partial_answer"]:
+            st.markdown(progress["partial_answer"])
+        elif progress["stage"] == SYNTHESIZE:
+            st.info("Creating your answer...")
+    
+    st.caption(f"⏳ {progress['elapsed']:.0f}s")
 
 # Main content area - use containers to better control UI updates
 main_container = st.container()
 
 with main_container:
-    # Display final answer if available
-    if st.session_state.final_answer:
-        col1, col2 = st.columns([1, 1])
-        
-        with col2:
-            # Display the final answer
-            st.markdown("## Answer")
-            st.markdown(st.session_state.final_answer)
-        
-        with col1:
-            # Show the research details
-            st.markdown("## Research Details")
-            
-            # Display subtasks
-            st.markdown("### Subtasks")
-            for i, task in enumerate(st.session_state.subtasks, 1):
-                st.markdown(f"**Task {i}:** {task}")
-            
-            # Display results for each task
-            st.markdown("### Task Results")
-            for i, (t, r) in enumerate(st.session_state.results, 1):
-                st.expander(f"Task {i}: {t}", expanded=False).markdown(r)
-
-    # When the user clicks the Send button
-    elif send_button and query and not st.session_state.running:
-        # Mark as running to prevent multiple executions
-        st.session_state.running = True
-        
-        # Create a 2-column layout for better organization
-        col1, col2 = st.columns([1, 1])
-        
-        with col1:
-            # Create a container for the research with a better visual
-            st.subheader("Research")
-            status = st.empty()
-            status.info("⏳ Analyzing your question...")
-            
-            # Create a container for subtasks
-            st.markdown("### Subtasks")
-            subtasks_placeholder = st.empty()
-            
-            # Create container for research results
-            st.markdown("### Task Results")
-            results_container = st.container()
-        
-        with col2:
-            # Create a container for the final answer (prioritized)
-            st.subheader("Answer")
-            final_answer_placeholder = st.empty()
-        
-        # Define callback functions to update the UI in real-time
-        def on_decompose_start():
-            status.info("🔍 Breaking down your question into subtasks...")
-        
-        def on_subtasks(subtasks):
-            # Store subtasks in session state
-            st.session_state.subtasks = subtasks
-            
-            status.success("✅ Question broken down into subtasks")
-            # Create a bulleted list of subtasks
-            subtasks_markdown = ""
-            for i, task in enumerate(subtasks, 1):
-                subtasks_markdown += f"**Task {i}:** {task}\n\n"
-            subtasks_placeholder.markdown(subtasks_markdown)
-        
-        def on_task_start(task):
-            status.info(f"🔄 Researching: **{task}**")
-        
-        def on_task_complete(task, result):
-            # Add the new result to session state
-            st.session_state.results.append((task, result))
-            
-            # Get current task index (1-based)
-            task_index = len(st.session_state.results)
-                    
-            # Display the new result in the results container
-            with results_container:
-                # Create a new expander (not nested) for this task result
-                expander = st.expander(f"Task {task_index}: {task}", expanded=True)
-                expander.markdown(result)
-        
-        def on_synthesize_start():
-            status.info("🔄 Synthesizing final answer...")
-            final_answer_placeholder.info("Creating your answer...")
-        
-        def on_answer_complete(answer):
-            status.success("✅ Answer generated")
-            # Store the final answer in session state
-            st.session_state.final_answer = answer
-            # Display the final answer with markdown
-            final_answer_placeholder.markdown(answer)
-            # Reset the running flag when complete
-            st.session_state.running = False
-        
-        # Prepare callbacks dictionary
-        callbacks = {
-            "on_decompose_start": on_decompose_start,
-            "on_subtasks": on_subtasks,
-            "on_task_start": on_task_start,
-            "on_task_complete": on_task_complete,
-            "on_synthesize_start": on_synthesize_start,
-            "on_answer_complete": on_answer_complete
-        }
-        
-        # Process the query with our agent
-        try:
-            # Run the agent with the callbacks
-            agent.run(query=query, callbacks=callbacks)
-            
-        except Exception as e:
-            st.error(f"An error occurred: {str(e)}")
-            # Reset the running flag on error
-            st.session_state.running = False
+    if running:
+        render_progress()
+    elif st.session_state.run is not None:
+        render_answer(st.session_state.run.snapshot())
 
 # Add a "New Search" button to allow users to clear results and start fresh
-if st.session_state.final_answer:
+if st.session_state.run is not None and not running:
     if st.button("New Search", type="primary"):
         reset_results()
-        st.experimental_rerun()
+        st.rerun()
 
 st.caption("Created by Mohamed Wahib ABKARI | GDGOnCampus EMSI Casablanca") 
\ No newline at end of file
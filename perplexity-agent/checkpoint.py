@@ -0,0 +1,70 @@
+import asyncio
+import sqlite3
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+class SQLiteCheckpointer(SqliteSaver):
+    """LangGraph checkpointer keeping the state of agent runs in a SQLite file.
+
+    SqliteSaver only implements the sync interface; the async one used by ainvoke runs the
+    same queries on a worker thread, so resuming a thread never blocks the event loop.
+    """
+
+    @classmethod
+    def from_path(cls, path: str) -> "SQLiteCheckpointer":
+        """Open (or create) the checkpoint database at path."""
+        conn = sqlite3.connect(path, check_same_thread=False)
+        # setup() switches to WAL, where NORMAL sync is safe and avoids an fsync per checkpoint
+        conn.execute("PRAGMA synchronous=NORMAL")
+        checkpointer = cls(conn)
+        checkpointer.setup()
+        return checkpointer
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoints = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Forget every checkpoint of a thread."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (str(thread_id),))
+            self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (str(thread_id),))
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
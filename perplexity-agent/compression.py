@@ -0,0 +1,99 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from context_packing import estimate_tokens, split_passages
+from query_cache import tokenize
+
+
+def tfidf_matrix(documents: List[List[str]]) -> Tuple[np.ndarray, Dict[str, int], np.ndarray]:
+    """L2-normalized TF-IDF rows of tokenized documents, with the vocabulary and idf weights."""
+    vocabulary: Dict[str, int] = {}
+    rows, columns = [], []
+    for row, tokens in enumerate(documents):
+        for token in tokens:
+            rows.append(row)
+            columns.append(vocabulary.setdefault(token, len(vocabulary)))
+
+    tf = np.zeros((len(documents), max(len(vocabulary), 1)), dtype=np.float32)
+    np.add.at(tf, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)), 1)
+
+    document_frequency = (tf > 0).sum(axis=0)
+    idf = (np.log((1 + len(documents)) / (1 + document_frequency)) + 1).astype(np.float32)
+    matrix = tf * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-9), vocabulary, idf
+
+
+def compress_results(
+    query: str,
+    results: Dict[str, str],
+    ratio: float = 0.25,
+    redundancy: float = 0.7
+) -> Dict[str, str]:
+    """Extractive summary of each research result, keeping about `ratio` of its tokens.
+
+    Sentences are scored by their TF-IDF centrality within their result (how much of the
+    result they sum up), their similarity to the query and subtask, and their position.
+    The best ones are kept, within the token budget of their result, unless one already
+    kept (for any subtask) says nearly the same thing. Kept sentences stay in order.
+    """
+    sentences: List[Tuple[str, int, str]] = []
+    seen = set()
+    for subtask, result in results.items():
+        # A budget of 0 splits every paragraph into sentences
+        for position, sentence in enumerate(split_passages(result, max_tokens=0)):
+            # Repeated sentences only cost tokens
+            if sentence.lower() in seen:
+                continue
+            seen.add(sentence.lower())
+            sentences.append((subtask, position, sentence))
+
+    if not sentences:
+        return {subtask: "" for subtask in results}
+
+    vectors, vocabulary, idf = tfidf_matrix([tokenize(sentence) for _, _, sentence in sentences])
+    similarity = vectors @ vectors.T
+    tokens = np.array([estimate_tokens(sentence) for _, _, sentence in sentences])
+    owners = np.array([subtask for subtask, _, _ in sentences], dtype=object)
+
+    scores = np.zeros(len(sentences), dtype=np.float32)
+    for subtask in results:
+        group = np.flatnonzero(owners == subtask)
+        if not len(group):
+            continue
+        # Degree centrality: mean similarity to the other sentences of the same result
+        centrality = (similarity[np.ix_(group, group)].sum(axis=1) - 1) / max(len(group) - 1, 1)
+
+        # Relevance to what the subtask and the query ask
+        focus = np.zeros(vectors.shape[1], dtype=np.float32)
+        for token in tokenize(query + " " + subtask):
+            column = vocabulary.get(token)
+            if column is not None:
+                focus[column] += idf[column]
+        relevance = vectors[group] @ (focus / max(np.linalg.norm(focus), 1e-9))
+
+        scores[group] = centrality + relevance
+    # Small bonus for leading sentences, which usually hold the direct answer
+    scores += 0.1 / (1 + np.array([position for _, position, _ in sentences]))
+
+    budgets = {
+        subtask: ratio * tokens[owners == subtask].sum()
+        for subtask in results
+    }
+    used = {subtask: 0 for subtask in results}
+    selected: List[int] = []
+    for i in np.argsort(-scores, kind="stable"):
+        subtask = sentences[i][0]
+        # Each result keeps at least its best sentence not already said by another one
+        if used[subtask] and used[subtask] + tokens[i] > budgets[subtask]:
+            continue
+        if selected and similarity[i, selected].max() >= redundancy:
+            continue
+        selected.append(i)
+        used[subtask] += tokens[i]
+
+    compressed = {subtask: [] for subtask in results}
+    for i in sorted(selected):
+        compressed[sentences[i][0]].append(sentences[i][2])
+    return {subtask: "\n".join(kept) for subtask, kept in compressed.items()}
@@ -0,0 +1,113 @@
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from query_cache import tokenize
+
+# Rough BPE approximation: words are split into pieces of up to 4 characters
+_TOKEN_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(*-])")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of model tokens in a text without a tokenizer."""
+    return len(_TOKEN_PIECE.findall(text))
+
+
+def split_passages(text: str, max_tokens: int = 120) -> List[str]:
+    """Split a research result into paragraphs, and long paragraphs into sentences."""
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+
+        # Bullet lists are kept line by line
+        lines = [line.strip() for line in paragraph.split("\n") if line.strip()]
+        for line in lines if len(lines) > 1 else [paragraph]:
+            if estimate_tokens(line) <= max_tokens:
+                passages.append(line)
+            else:
+                passages.extend(s.strip() for s in _SENTENCE_END.split(line) if s.strip())
+    return passages
+
+
+def bm25_scores(query_terms: List[str], passages: List[List[str]], k1: float = 1.5, b: float = 0.75) -> np.ndarray:
+    """BM25 score of every tokenized passage against the query terms."""
+    terms = sorted(set(query_terms))
+    if not terms or not passages:
+        return np.zeros(len(passages))
+
+    index = {term: i for i, term in enumerate(terms)}
+    # Term frequencies, restricted to the query terms: one row per passage
+    tf = np.zeros((len(passages), len(terms)))
+    for row, tokens in enumerate(passages):
+        for token in tokens:
+            column = index.get(token)
+            if column is not None:
+                tf[row, column] += 1
+
+    lengths = np.array([len(tokens) for tokens in passages], dtype=float)
+    average_length = max(lengths.mean(), 1.0)
+    document_frequency = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(passages) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    norm = k1 * (1 - b + b * lengths / average_length)
+    return ((tf * (k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def pack_context(query: str, results: Dict[str, str], token_budget: int = 2000) -> Dict[str, str]:
+    """Keep the passages of each result most relevant to the query within a token budget.
+
+    Every subtask first gets its best passage, then the remaining budget goes to the
+    highest scoring passages overall. Selected passages keep their original order.
+    """
+    candidates: List[Tuple[str, int, str]] = []
+    seen = set()
+    for subtask, result in results.items():
+        for position, passage in enumerate(split_passages(result)):
+            # Repeated passages only cost tokens
+            if passage.lower() in seen:
+                continue
+            seen.add(passage.lower())
+            candidates.append((subtask, position, passage))
+
+    if not candidates:
+        return {subtask: "" for subtask in results}
+
+    tokens = np.array([estimate_tokens(passage) for _, _, passage in candidates])
+    scores = bm25_scores(
+        tokenize(query),
+        [tokenize(subtask + " " + passage) for subtask, _, passage in candidates]
+    )
+    # Small bonus for leading passages, which usually hold the direct answer
+    scores = scores + 0.1 / (1 + np.array([position for _, position, _ in candidates]))
+
+    selected = set()
+    used = 0
+
+    def take(i: int) -> None:
+        nonlocal used
+        if i not in selected and used + tokens[i] <= token_budget:
+            selected.add(i)
+            used += tokens[i]
+
+    order = np.argsort(-scores, kind="stable")
+
+    # Coverage: the best passage of each subtask
+    covered = set()
+    for i in order:
+        subtask = candidates[i][0]
+        if subtask not in covered:
+            covered.add(subtask)
+            take(i)
+
+    # Relevance: fill the rest of the budget
+    for i in order:
+        take(i)
+
+    packed = {subtask: [] for subtask in results}
+    for i in sorted(selected):
+        packed[candidates[i][0]].append(candidates[i][2])
+    return {subtask: "\n\n".join(passages) for subtask, passages in packed.items()}
@@ -0,0 +1,55 @@
+import threading
+from typing import Any, Dict, Hashable, Optional
+
+from cache import TTLCache
+
+
+class ConversationStore:
+    """Earlier turns and research results of each conversation, for follow-up queries.
+
+    At most `max_conversations` conversations are kept, the least recently used evicted first,
+    and a conversation is forgotten `ttl` seconds after its last turn. Each one keeps its last
+    `max_turns` questions and answers and the results of its last `max_results` subtasks.
+    """
+
+    def __init__(
+        self,
+        max_conversations: int = 10_000,
+        ttl: Optional[float] = 3600,
+        max_turns: int = 5,
+        max_results: int = 30
+    ):
+        self.max_turns = max_turns
+        self.max_results = max_results
+        self._conversations = TTLCache(max_size=max_conversations, ttl=ttl)
+        # Turns of one conversation are recorded one at a time
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: Hashable) -> Optional[Dict[str, Any]]:
+        """The history of a conversation ({"turns": [...], "results": {...}}), None if unknown."""
+        history = self._conversations.get(conversation_id)
+        if history is None:
+            return None
+        return {"turns": list(history["turns"]), "results": dict(history["results"])}
+
+    def record(self, conversation_id: Hashable, query: str, answer: str, results: Dict[str, str]) -> None:
+        """Add a turn and the research results it used (or produced) to a conversation."""
+        with self._lock:
+            history = self._conversations.get(conversation_id) or {"turns": [], "results": {}}
+            turns = (history["turns"] + [{"query": query, "answer": answer}])[-self.max_turns:]
+
+            # Results used again move to the end, so the oldest unused ones go first
+            merged = {subtask: result for subtask, result in history["results"].items() if subtask not in results}
+            merged.update(results)
+            kept = list(merged.items())[-self.max_results:] if self.max_results > 0 else []
+
+            self._conversations.set(conversation_id, {"turns": turns, "results": dict(kept)})
+
+    def clear(self) -> None:
+        self._conversations.clear()
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._conversations.stats()
@@ -0,0 +1,240 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Hashable, Optional
+
+
+class SQLiteCache:
+    """A cache in a SQLite file, shared by every process of the host (e.g. uvicorn workers).
+
+    The database runs in WAL mode, so readers never wait for a writer and concurrent writers
+    queue on SQLite's lock (up to `timeout` seconds). Values are stored as zlib-compressed
+    JSON and expire after `ttl` seconds of wall-clock time. Every `evict_every` writes the
+    process removes expired entries and, past `max_bytes` of compressed values in its
+    namespace, the least recently used ones. Database errors count as misses or dropped
+    writes: the cache never fails a query.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        namespace: str = "default",
+        ttl: Optional[float] = 3600,
+        max_bytes: int = 256 * 1024 * 1024,
+        compress_level: int = 6,
+        evict_every: int = 64,
+        touch_interval: float = 60.0,
+        timeout: float = 5.0
+    ):
+        self.path = path
+        # Several caches (research, answers...) can share one file
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.evict_every = evict_every
+        # Recency is only written back once per interval, so hits rarely take the write lock
+        self.touch_interval = touch_interval
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed_at)")
+        self._writes = 0
+
+        # Counters of this process reported by stats()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _encode(self, value: Any) -> bytes:
+        return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), self.compress_level)
+
+    @staticmethod
+    def _decode(blob: bytes) -> Any:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired."""
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, str(key))
+                ).fetchone()
+
+                if row is None:
+                    self.misses += 1
+                    return default
+
+                blob, expires_at, accessed_at = row
+                if expires_at is not None and expires_at <= now:
+                    with self._conn:
+                        self._conn.execute(
+                            "DELETE FROM cache WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                            (self.namespace, str(key), now)
+                        )
+                    self.expirations += 1
+                    self.misses += 1
+                    return default
+
+                if now - accessed_at >= self.touch_interval:
+                    with self._conn:
+                        self._conn.execute(
+                            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                            (now, self.namespace, str(key))
+                        )
+                value = self._decode(blob)
+                self.hits += 1
+                return value
+        except (sqlite3.Error, zlib.error, ValueError):
+            with self._lock:
+                self.errors += 1
+                self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting expired and least recently used entries from time to time."""
+        if self.max_bytes <= 0:
+            return
+
+        blob = self._encode(value)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+
+        try:
+            with self._lock:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO cache (namespace, key, value, size, expires_at, accessed_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (self.namespace, str(key), blob, len(blob), expires_at, now)
+                    )
+                self._writes += 1
+                if self._writes % self.evict_every == 0:
+                    self._evict(now)
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones past max_bytes (lock held)."""
+        with self._conn:
+            expired = self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, now)
+            ).rowcount
+            self.expirations += max(0, expired)
+
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            # Free a tenth of the budget at once, so eviction doesn't run on every write
+            excess = total - int(self.max_bytes * 0.9)
+            victims = []
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM cache WHERE namespace = ? ORDER BY accessed_at", (self.namespace,)
+            ):
+                if excess <= 0:
+                    break
+                victims.append((self.namespace, key))
+                excess -= size
+            self._conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", victims)
+            self.evictions += len(victims)
+
+    def clear(self) -> None:
+        """Remove every entry of the namespace, for all processes (counters are kept)."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit/miss counters of this process and the shared size."""
+        with self._lock:
+            size, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "size": size,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TieredCache:
+    """An in-process cache in front of a cache shared between processes.
+
+    Lookups try the local tier first and copy shared hits into it; writes go to both.
+    """
+
+    def __init__(self, local, shared: SQLiteCache):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        value = self.shared.get(key)
+        if value is None:
+            return default
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.local.set(key, value)
+        self.shared.set(key, value)
+
+    def clear(self) -> None:
+        self.local.clear()
+        self.shared.clear()
+
+    def __len__(self) -> int:
+        return len(self.local)
+
+    def stats(self) -> Dict[str, Any]:
+        """Stats of both tiers, and the hit rate of the whole cache."""
+        local, shared = self.local.stats(), self.shared.stats()
+        lookups = local["hits"] + local["misses"]
+        hits = local["hits"] + shared["hits"]
+        return {
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "local": local,
+            "shared": shared,
+        }
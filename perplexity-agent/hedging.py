@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from telemetry import LLM_HEDGES, current_span
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Rolling window of the latencies of successful calls."""
+
+    def __init__(self, window: int = 256):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Nearest-rank quantile of the window, None while it is empty."""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class Hedger:
+    """Per-call deadline and hedged duplicates for slow model calls.
+
+    Once min_samples calls were observed, a call still running after the `quantile`
+    latency gets one duplicate; the first to succeed wins and the other is cancelled.
+    Every call earns `budget` hedge credit (up to `burst`), so hedging adds at most about
+    budget * calls extra calls. A call that has not succeeded after `deadline` seconds
+    raises TimeoutError.
+
+    Sync calls run on a private thread pool, where a losing call cannot be interrupted:
+    its result is simply ignored. Async losers are cancelled.
+    """
+
+    def __init__(
+        self,
+        deadline: Optional[float] = 60.0,
+        quantile: Optional[float] = 0.9,
+        budget: float = 0.1,
+        burst: float = 5.0,
+        min_samples: int = 20,
+        window: int = 256,
+        max_workers: int = 32
+    ):
+        self.deadline = deadline
+        self.quantile = quantile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker(window)
+        self.max_workers = max_workers
+
+        self._credit = 0.0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedges_won = 0
+        self.timeouts = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a call gets a duplicate, None while hedging is off."""
+        if self.quantile is None or len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.quantile(self.quantile)
+
+    def _start(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self._credit = min(self.burst, self._credit + self.budget)
+
+    def _spend(self) -> bool:
+        """Take one hedge from the budget if there is one left."""
+        with self._lock:
+            if self._credit < 1:
+                return False
+            self._credit -= 1
+            self.hedged += 1
+            return True
+
+    def _finish(self, node: str, hedged: bool, won_by_hedge: bool) -> None:
+        if not hedged:
+            return
+        LLM_HEDGES.inc(node=node, result="won" if won_by_hedge else "lost")
+        with self._lock:
+            self.hedges_won += won_by_hedge
+        span = current_span()
+        if span is not None:
+            span.set(hedged=True, hedge_won=won_by_hedge)
+
+    def _timeout(self, node: str) -> TimeoutError:
+        with self._lock:
+            self.timeouts += 1
+        return TimeoutError(f"{node} call exceeded its {self.deadline}s deadline")
+
+    def _timed(self, fn: Callable[[], T]) -> T:
+        start = time.perf_counter()
+        result = fn()
+        self.latencies.observe(time.perf_counter() - start)
+        return result
+
+    async def _atimed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        start = time.perf_counter()
+        result = await fn()
+        self.latencies.observe(time.perf_counter() - start)
+        return result
+
+    def _submit(self, fn: Callable[[], T]) -> "Future[T]":
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="hedge")
+        # Keep the trace of the caller
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._timed, fn)
+
+    def call(self, fn: Callable[[], T], node: str = "research") -> T:
+        """Run fn with a deadline, hedging it if it is slow."""
+        self._start()
+        delay = self.hedge_delay()
+        if delay is None and self.deadline is None:
+            return self._timed(fn)
+
+        start = time.monotonic()
+        deadline = start + self.deadline if self.deadline is not None else math.inf
+        hedge_at = start + delay if delay is not None else math.inf
+        primary = self._submit(fn)
+        pending = {primary}
+        hedged = False
+        error: Optional[BaseException] = None
+
+        while True:
+            wake_at = deadline if hedged else min(deadline, hedge_at)
+            timeout = None if math.isinf(wake_at) else max(0.0, wake_at - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self._finish(node, hedged, future is not primary)
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                # Every attempt failed
+                raise error
+
+            now = time.monotonic()
+            if now >= deadline:
+                for other in pending:
+                    other.cancel()
+                raise self._timeout(node)
+            if not hedged and now >= hedge_at:
+                hedged = True
+                if self._spend():
+                    pending.add(self._submit(fn))
+                else:
+                    hedged = False
+                    hedge_at = math.inf
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], node: str = "research") -> T:
+        """Async variant of call."""
+        self._start()
+        delay = self.hedge_delay()
+        if delay is None and self.deadline is None:
+            return await self._atimed(fn)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.deadline if self.deadline is not None else math.inf
+        hedge_at = start + delay if delay is not None else math.inf
+        primary = asyncio.ensure_future(self._atimed(fn))
+        pending = {primary}
+        hedged = False
+        error: Optional[BaseException] = None
+
+        try:
+            while True:
+                wake_at = deadline if hedged else min(deadline, hedge_at)
+                timeout = None if math.isinf(wake_at) else max(0.0, wake_at - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        self._finish(node, hedged, task is not primary)
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+
+                now = loop.time()
+                if now >= deadline:
+                    raise self._timeout(node)
+                if not hedged and now >= hedge_at:
+                    hedged = True
+                    if self._spend():
+                        pending.add(asyncio.ensure_future(self._atimed(fn)))
+                    else:
+                        hedged = False
+                        hedge_at = math.inf
+        finally:
+            # Cancel the loser, or every attempt on timeout or cancellation
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hedging counters and the current hedge delay."""
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedges_won": self.hedges_won,
+                "timeouts": self.timeouts,
+                "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+            }
@@ -0,0 +1,57 @@
+import json
+from typing import List
+
+
+class StringArrayParser:
+    """Incremental parser of a streamed JSON array of strings.
+
+    Feed it the chunks of a response as they arrive; every string element is returned by
+    the feed call that completes it, i.e. as soon as its closing quote is received. Text
+    before the opening bracket (such as a ```json fence) is skipped, and elements that are
+    not strings are ignored.
+    """
+
+    def __init__(self):
+        self.items: List[str] = []
+        self.done = False
+        self._started = False
+        self._in_string = False
+        self._escaped = False
+        self._current: List[str] = []
+
+    def feed(self, chunk: str) -> List[str]:
+        """Consume a chunk and return the strings it completed."""
+        completed = []
+        for char in chunk:
+            if self.done:
+                break
+
+            if self._in_string:
+                self._current.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    item = self._decode("".join(self._current))
+                    self._current = []
+                    if item is not None:
+                        completed.append(item)
+            elif not self._started:
+                self._started = char == "["
+            elif char == '"':
+                self._in_string = True
+                self._current = ['"']
+            elif char == "]":
+                self.done = True
+
+        self.items.extend(completed)
+        return completed
+
+    @staticmethod
+    def _decode(literal: str):
+        try:
+            return json.loads(literal)
+        except ValueError:
+            return None
@@ -0,0 +1,487 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+from context_packing import estimate_tokens
+from rate_limit import FAILED, OK, THROTTLED, AdaptiveRateLimiter
+from telemetry import LLM_RETRIES
+
+
+@dataclass
+class LLMResponse:
+    """Text generated by a backend, with its token usage."""
+    text: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+
+# What a backend stream yields: text chunks, then the complete response with its usage
+StreamItem = Union[str, LLMResponse]
+
+
+class LLMError(Exception):
+    """A failed model call, with the HTTP-like status code of the failure when known."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RateLimitError(LLMError):
+    """The backend refused the call because the quota was exceeded (429)."""
+
+    def __init__(self, message: str = "Resource exhausted", status_code: int = 429):
+        super().__init__(message, status_code)
+
+
+class LLMBackend(ABC):
+    """Interface used by the graph nodes to call a language model.
+
+    node is the graph node making the call ("decompose", "research" or "synthesize"),
+    model_id and config come from the node's model profile.
+    """
+
+    @abstractmethod
+    def generate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        """Generate a complete response."""
+
+    @abstractmethod
+    async def agenerate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        """Async variant of generate."""
+
+    def stream(self, node: str, prompt: str, model_id: str, config: Any) -> Iterator[StreamItem]:
+        """Generate a response chunk by chunk (defaults to a single chunk).
+
+        The text chunks may be followed by the complete LLMResponse, to report the token usage.
+        """
+        response = self.generate(node, prompt, model_id, config)
+        yield response.text
+        yield response
+
+    async def astream(self, node: str, prompt: str, model_id: str, config: Any) -> AsyncIterator[StreamItem]:
+        """Async variant of stream."""
+        response = await self.agenerate(node, prompt, model_id, config)
+        yield response.text
+        yield response
+
+    def warm_up(self) -> None:
+        """Create clients and import SDKs ahead of the first call (nothing by default)."""
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend counters, if any."""
+        return {}
+
+
+class GeminiBackend(LLMBackend):
+    """Calls Gemini through the google-genai client, created on first use."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The genai client, created once and shared by every call."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google import genai
+                    self._client = genai.Client(api_key=self.api_key or os.environ.get("GOOGLE_API_KEY"))
+        return self._client
+
+    def warm_up(self) -> None:
+        """Create the client and import the modules used by every call."""
+        import google.genai.errors
+        import google.genai.types
+        self.client
+
+    @staticmethod
+    def _contents(prompt: str) -> List:
+        from google.genai import types
+        return [
+            types.Content(
+                role="user",
+                parts=[types.Part.from_text(text=prompt)]
+            )
+        ]
+
+    @staticmethod
+    def _with_usage(text: str, usage) -> LLMResponse:
+        return LLMResponse(
+            text=text,
+            prompt_tokens=(usage.prompt_token_count or 0) if usage else 0,
+            output_tokens=(usage.candidates_token_count or 0) if usage else 0
+        )
+
+    @staticmethod
+    def _response(response) -> LLMResponse:
+        return GeminiBackend._with_usage(response.candidates[0].content.parts[0].text.strip(), response.usage_metadata)
+
+    @staticmethod
+    def _error(error: Exception) -> Exception:
+        """Map google-genai API errors onto LLMError so callers can tell 429s apart."""
+        from google.genai import errors
+        if isinstance(error, errors.APIError):
+            if error.code == 429:
+                return RateLimitError(str(error))
+            return LLMError(str(error), error.code)
+        return error
+
+    def generate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        try:
+            response = self.client.models.generate_content(
+                model=model_id,
+                contents=self._contents(prompt),
+                config=config
+            )
+        except Exception as e:
+            raise self._error(e) from e
+        return self._response(response)
+
+    async def agenerate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=model_id,
+                contents=self._contents(prompt),
+                config=config
+            )
+        except Exception as e:
+            raise self._error(e) from e
+        return self._response(response)
+
+    def stream(self, node: str, prompt: str, model_id: str, config: Any) -> Iterator[StreamItem]:
+        texts = []
+        usage = None
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=model_id,
+                contents=self._contents(prompt),
+                config=config
+            ):
+                # The usage comes with the last chunk
+                usage = chunk.usage_metadata or usage
+                if chunk.text:
+                    texts.append(chunk.text)
+                    yield chunk.text
+        except Exception as e:
+            raise self._error(e) from e
+        if usage is not None:
+            yield self._with_usage("".join(texts).strip(), usage)
+
+    async def astream(self, node: str, prompt: str, model_id: str, config: Any) -> AsyncIterator[StreamItem]:
+        texts = []
+        usage = None
+        try:
+            async for chunk in await self.client.aio.models.generate_content_stream(
+                model=model_id,
+                contents=self._contents(prompt),
+                config=config
+            ):
+                usage = chunk.usage_metadata or usage
+                if chunk.text:
+                    texts.append(chunk.text)
+                    yield chunk.text
+        except Exception as e:
+            raise self._error(e) from e
+        if usage is not None:
+            yield self._with_usage("".join(texts).strip(), usage)
+
+
+class SimulatedBackend(LLMBackend):
+    """Deterministic local stand-in for Gemini, for load tests and benchmarks.
+
+    Latencies follow a log-normal distribution per node, given as (median seconds, sigma).
+    Failures are drawn with error_rate (503) and rate_limit_rate (429); requests_per_second
+    additionally enforces a quota like the real API, answering 429 once it is exceeded.
+    Responses only depend on the prompt, so runs are reproducible for a given seed.
+    """
+
+    DEFAULT_LATENCY = {
+        "decompose": (0.4, 0.3),
+        "research": (3.0, 0.5),
+        "synthesize": (2.0, 0.3),
+    }
+    DEFAULT_OUTPUT_TOKENS = {
+        "decompose": 30,
+        "research": 600,
+        "synthesize": 300,
+    }
+
+    def __init__(
+        self,
+        latency: Optional[Dict[str, Tuple[float, float]]] = None,
+        time_scale: float = 1.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        requests_per_second: Optional[float] = None,
+        output_tokens: Optional[Dict[str, int]] = None,
+        subtasks: int = 3,
+        stream_chunks: int = 8,
+        seed: int = 0
+    ):
+        self.latency = {**self.DEFAULT_LATENCY, **(latency or {})}
+        # Multiplies every latency, e.g. 0.01 to run a benchmark 100x faster
+        self.time_scale = time_scale
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests_per_second = requests_per_second
+        self.output_tokens = {**self.DEFAULT_OUTPUT_TOKENS, **(output_tokens or {})}
+        self.subtasks = subtasks
+        self.stream_chunks = stream_chunks
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Sliding one-second window of accepted calls, for the quota
+        self._window: List[float] = []
+
+        self.calls: Counter = Counter()
+        self.failures: Counter = Counter()
+
+    def _draw(self, node: str) -> Tuple[float, Optional[LLMError]]:
+        """Draw the latency and outcome of one call."""
+        with self._lock:
+            self.calls[node] += 1
+            median, sigma = self.latency.get(node, (1.0, 0.3))
+            delay = median * math.exp(sigma * self._random.gauss(0, 1)) * self.time_scale
+
+            now = time.monotonic()
+            error = None
+            if self.requests_per_second is not None:
+                self._window = [t for t in self._window if t > now - 1]
+                if len(self._window) >= self.requests_per_second:
+                    error = RateLimitError("Quota exceeded")
+            if error is None:
+                roll = self._random.random()
+                if roll < self.rate_limit_rate:
+                    error = RateLimitError()
+                elif roll < self.rate_limit_rate + self.error_rate:
+                    error = LLMError("Service unavailable", 503)
+            if error is None:
+                self._window.append(now)
+            else:
+                self.failures[error.status_code] += 1
+                # Errors come back faster than answers
+                delay *= 0.2
+            return delay, error
+
+    def _respond(self, node: str, prompt: str) -> LLMResponse:
+        """Deterministic response for a prompt."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        output_tokens = self.output_tokens.get(node, 100)
+
+        if node == "decompose":
+            match = re.search(r"Query:\s*(.+)", prompt)
+            query = match.group(1).strip() if match else digest[:8]
+            # A follow-up only needs the research its conversation doesn't have yet
+            count = 1 if "Already researched:" in prompt else self.subtasks
+            text = json.dumps([f"Aspect {i + 1} of: {query}" for i in range(count)])
+        else:
+            subject = prompt.strip().split("\n")[0][:80]
+            sentence = f"Simulated {node} finding {digest[:6]} about {subject}."
+            repeats = max(1, output_tokens // max(estimate_tokens(sentence), 1))
+            text = " ".join([sentence] * repeats)
+
+        return LLMResponse(text=text, prompt_tokens=estimate_tokens(prompt), output_tokens=output_tokens)
+
+    def generate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        delay, error = self._draw(node)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return self._respond(node, prompt)
+
+    async def agenerate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        delay, error = self._draw(node)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._respond(node, prompt)
+
+    def _chunks(self, text: str) -> List[str]:
+        size = max(1, math.ceil(len(text) / self.stream_chunks))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def stream(self, node: str, prompt: str, model_id: str, config: Any) -> Iterator[StreamItem]:
+        delay, error = self._draw(node)
+        if error is not None:
+            time.sleep(delay)
+            raise error
+        response = self._respond(node, prompt)
+        chunks = self._chunks(response.text)
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            yield chunk
+        yield response
+
+    async def astream(self, node: str, prompt: str, model_id: str, config: Any) -> AsyncIterator[StreamItem]:
+        delay, error = self._draw(node)
+        if error is not None:
+            await asyncio.sleep(delay)
+            raise error
+        response = self._respond(node, prompt)
+        chunks = self._chunks(response.text)
+        for chunk in chunks:
+            await asyncio.sleep(delay / len(chunks))
+            yield chunk
+        yield response
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls made per node and failures per status code."""
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "total_calls": sum(self.calls.values()),
+                "failures": dict(self.failures),
+            }
+
+
+# Status codes meaning the backend is overloaded: back off and retry
+RETRYABLE_STATUS = (429, 503)
+
+
+class RateLimitedBackend(LLMBackend):
+    """Admits calls to another backend through a shared AdaptiveRateLimiter.
+
+    Throttled calls (429/503) shrink the limiter and are retried up to max_retries times
+    after an exponential backoff with full jitter. Streams are only retried before their
+    first chunk.
+    """
+
+    def __init__(
+        self,
+        backend: LLMBackend,
+        limiter: Optional[AdaptiveRateLimiter] = None,
+        max_retries: int = 3,
+        base_backoff: float = 0.5,
+        max_backoff: float = 8.0
+    ):
+        self.backend = backend
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    @staticmethod
+    def _outcome(error: BaseException) -> str:
+        if isinstance(error, LLMError) and error.status_code in RETRYABLE_STATUS:
+            return THROTTLED
+        # Cancelled calls say nothing about the backend's capacity
+        return FAILED if isinstance(error, Exception) else "cancelled"
+
+    def _retry_delay(self, node: str, error: BaseException, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying, or None when the error must be raised."""
+        if self._outcome(error) != THROTTLED or attempt >= self.max_retries:
+            return None
+        LLM_RETRIES.inc(node=node)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def generate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        for attempt in itertools.count():
+            self.limiter.acquire()
+            try:
+                response = self.backend.generate(node, prompt, model_id, config)
+            except BaseException as e:
+                self.limiter.release(self._outcome(e))
+                delay = self._retry_delay(node, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.limiter.release(OK)
+            return response
+
+    async def agenerate(self, node: str, prompt: str, model_id: str, config: Any) -> LLMResponse:
+        for attempt in itertools.count():
+            await self.limiter.aacquire()
+            try:
+                response = await self.backend.agenerate(node, prompt, model_id, config)
+            except BaseException as e:
+                self.limiter.release(self._outcome(e))
+                delay = self._retry_delay(node, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.limiter.release(OK)
+            return response
+
+    def stream(self, node: str, prompt: str, model_id: str, config: Any) -> Iterator[StreamItem]:
+        for attempt in itertools.count():
+            self.limiter.acquire()
+            started = False
+            try:
+                for chunk in self.backend.stream(node, prompt, model_id, config):
+                    started = True
+                    yield chunk
+            except BaseException as e:
+                self.limiter.release(self._outcome(e))
+                delay = None if started else self._retry_delay(node, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.limiter.release(OK)
+            return
+
+    async def astream(self, node: str, prompt: str, model_id: str, config: Any) -> AsyncIterator[StreamItem]:
+        for attempt in itertools.count():
+            await self.limiter.aacquire()
+            started = False
+            try:
+                async for chunk in self.backend.astream(node, prompt, model_id, config):
+                    started = True
+                    yield chunk
+            except BaseException as e:
+                self.limiter.release(self._outcome(e))
+                delay = None if started else self._retry_delay(node, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.limiter.release(OK)
+            return
+
+    def warm_up(self) -> None:
+        self.backend.warm_up()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.backend.stats(), "rate_limiter": self.limiter.stats()}
+
+
+def backend_from_env(environ=os.environ) -> LLMBackend:
+    """Gemini by default, or the simulator when PERPLEXITY_BACKEND=simulated.
+
+    Either is wrapped in a RateLimitedBackend configured by PERPLEXITY_RPS (the quota, if
+    known), PERPLEXITY_MAX_CONCURRENCY and PERPLEXITY_MAX_RETRIES.
+    The simulator reads PERPLEXITY_SIM_TIME_SCALE, PERPLEXITY_SIM_ERROR_RATE,
+    PERPLEXITY_SIM_RATE_LIMIT_RATE and PERPLEXITY_SIM_RPS.
+    """
+    if environ.get("PERPLEXITY_BACKEND", "gemini").lower() != "simulated":
+        backend = GeminiBackend()
+    else:
+        sim_rps = environ.get("PERPLEXITY_SIM_RPS")
+        backend = SimulatedBackend(
+            time_scale=float(environ.get("PERPLEXITY_SIM_TIME_SCALE", 1.0)),
+            error_rate=float(environ.get("PERPLEXITY_SIM_ERROR_RATE", 0.0)),
+            rate_limit_rate=float(environ.get("PERPLEXITY_SIM_RATE_LIMIT_RATE", 0.0)),
+            requests_per_second=float(sim_rps) if sim_rps else None
+        )
+
+    rps = environ.get("PERPLEXITY_RPS")
+    limiter = AdaptiveRateLimiter(
+        requests_per_second=float(rps) if rps else None,
+        max_concurrency=int(environ.get("PERPLEXITY_MAX_CONCURRENCY", 32))
+    )
+    return RateLimitedBackend(backend, limiter, max_retries=int(environ.get("PERPLEXITY_MAX_RETRIES", 3)))
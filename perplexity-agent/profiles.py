@@ -0,0 +1,126 @@
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+SEARCH_INSTRUCTION = """
+        You are an AI assistant that can search the web for information.
+        When asked questions about recent events, facts, or topics that require up-to-date information,
+        use the Google Search tool to find relevant information before responding.
+        Do not include or mention your sources in your responses.
+        """
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """Model and generation settings used by one node of the graph."""
+    model_id: str
+    temperature: float = 0.7
+    max_output_tokens: int = 8192
+    use_search: bool = False  # Ground the answer with the Google Search tool
+    json_output: bool = False  # Ask for a JSON array of strings instead of free text
+    system_instruction: Optional[str] = None
+
+    def build_config(self) -> Any:
+        """Build the generation config (a google-genai GenerateContentConfig) for this profile."""
+        # Imported here: google-genai takes about half a second to import
+        from google.genai import types
+
+        config = {
+            "temperature": self.temperature,
+            "max_output_tokens": self.max_output_tokens,
+        }
+        if self.use_search:
+            config["tools"] = [types.Tool(google_search=types.GoogleSearch())]
+        if self.json_output:
+            config["response_mime_type"] = "application/json"
+            config["response_schema"] = types.Schema(
+                type=types.Type.ARRAY,
+                items=types.Schema(type=types.Type.STRING)
+            )
+        if self.system_instruction:
+            config["system_instruction"] = self.system_instruction
+        return types.GenerateContentConfig(**config)
+
+
+DEFAULT_PROFILES: Dict[str, ModelProfile] = {
+    # Decompose only emits a short JSON array: fast model, no search, structured output
+    "decompose": ModelProfile(
+        model_id="gemini-2.0-flash",
+        temperature=0.2,
+        max_output_tokens=256,
+        json_output=True
+    ),
+    "research": ModelProfile(
+        model_id="gemini-2.0-pro-exp-02-05",
+        use_search=True,
+        system_instruction=SEARCH_INSTRUCTION
+    ),
+    # Synthesize works from the research context, the answer is limited to ~1024 tokens
+    "synthesize": ModelProfile(
+        model_id="gemini-2.0-pro-exp-02-05",
+        max_output_tokens=2048
+    ),
+}
+
+
+def _env_flag(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def profiles_from_env(
+    base: Mapping[str, ModelProfile] = DEFAULT_PROFILES,
+    environ: Mapping[str, str] = os.environ
+) -> Dict[str, ModelProfile]:
+    """Apply per-deployment overrides such as PERPLEXITY_DECOMPOSE_MODEL=gemini-2.0-flash-lite.
+
+    Supported suffixes are _MODEL, _TEMPERATURE, _MAX_TOKENS, _SEARCH and _JSON.
+    """
+    profiles = {}
+    for node, profile in base.items():
+        prefix = f"PERPLEXITY_{node.upper()}_"
+        overrides = {}
+        if prefix + "MODEL" in environ:
+            overrides["model_id"] = environ[prefix + "MODEL"]
+        if prefix + "TEMPERATURE" in environ:
+            overrides["temperature"] = float(environ[prefix + "TEMPERATURE"])
+        if prefix + "MAX_TOKENS" in environ:
+            overrides["max_output_tokens"] = int(environ[prefix + "MAX_TOKENS"])
+        if prefix + "SEARCH" in environ:
+            overrides["use_search"] = _env_flag(environ[prefix + "SEARCH"])
+        if prefix + "JSON" in environ:
+            overrides["json_output"] = _env_flag(environ[prefix + "JSON"])
+        profiles[node] = replace(profile, **overrides)
+    return profiles
+
+
+class ProfileRegistry:
+    """Generation configs for every node, built on first use and reused by every call."""
+
+    def __init__(self, profiles: Optional[Mapping[str, ModelProfile]] = None):
+        self.profiles = dict(profiles if profiles is not None else profiles_from_env())
+        self._configs: Dict[str, Tuple[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Identifies the model setup in cache keys
+        self._fingerprints: Dict[str, str] = {node: repr(profile) for node, profile in self.profiles.items()}
+
+    def get(self, node: str) -> Tuple[str, Any]:
+        """Model id and generation config for a node."""
+        config = self._configs.get(node)
+        if config is None:
+            with self._lock:
+                config = self._configs.get(node)
+                if config is None:
+                    profile = self.profiles[node]
+                    config = (profile.model_id, profile.build_config())
+                    self._configs[node] = config
+        return config
+
+    def build_all(self) -> None:
+        """Build every config now, so the first calls don't pay for it."""
+        for node in self.profiles:
+            self.get(node)
+
+    def fingerprint(self, node: str) -> str:
+        """Stable description of a node's model setup."""
+        return self._fingerprints[node]
@@ -0,0 +1,302 @@
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+# Words that do not change what a question is about
+STOPWORDS = frozenset("""
+a about an and are as at be but by can could did do does for from give has have how i in
+is it its me my of on or please should tell that the their there these this to us was
+what whats when where which who why will with would you your
+""".split())
+
+# Words that decide what a question asks ("who founded" vs "when was ... founded")
+QUESTION_WORDS = frozenset("how what whats when where which who why".split())
+
+# Mersenne prime used as the modulus of the MinHash permutations
+_PRIME = np.uint64((1 << 31) - 1)
+
+
+def words(text: str) -> List[str]:
+    """Lowercase words of a text, apostrophes removed."""
+    return re.findall(r"[a-z0-9]+", text.lower().replace("'", ""))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of a query without stopwords and plural endings."""
+    tokens = []
+    for word in words(text):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def question_words(text: str) -> FrozenSet[str]:
+    """What a query asks: its question words, "what" for a query without any."""
+    asked = frozenset("what" if word == "whats" else word for word in words(text) if word in QUESTION_WORDS)
+    return asked or frozenset(["what"])
+
+
+def reverses(left: List[str], right: List[str]) -> bool:
+    """Whether two word sequences are one question with its subjects in reverse order.
+
+    The words that moved are in reverse order, around at least one word that stayed in place:
+    "java faster than python" and "python faster than java" ask opposite questions, while
+    swapped neighbours ("france capital", "capital france") usually ask the same one.
+    """
+    if len(left) != len(right):
+        return False
+    moved = [i for i, (word, other) in enumerate(zip(left, right)) if word != other]
+    if len(moved) < 2 or moved[-1] - moved[0] + 1 == len(moved):
+        return False
+    return [left[i] for i in moved] == [right[i] for i in reversed(moved)]
+
+
+def shingles(tokens: List[str], size: int = 1) -> FrozenSet[str]:
+    """Set of word shingles (n-grams) of the given size."""
+    if size <= 1 or len(tokens) < size:
+        return frozenset(tokens)
+    return frozenset(" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+
+def jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    """Exact Jaccard similarity of two shingle sets."""
+    if not left and not right:
+        return 1.0
+    return len(left & right) / len(left | right)
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Pick the LSH (bands, rows) split whose similarity threshold is closest below the target."""
+    best = (num_perm, 1)
+    best_error = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        # Similarity at which a pair becomes a candidate with probability ~1/2
+        lsh_threshold = (1 / bands) ** (1 / rows)
+        # Prefer thresholds below the target: a false candidate costs one set comparison,
+        # a missed one costs a full pipeline run
+        error = threshold - lsh_threshold if lsh_threshold <= threshold else 2 * (lsh_threshold - threshold)
+        if best_error is None or error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class MinHasher:
+    """Computes MinHash signatures with vectorized universal hashing."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, int(_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=(num_perm, 1), dtype=np.uint64)
+
+    def signature(self, items: FrozenSet[str]) -> np.ndarray:
+        """MinHash signature of a non-empty set of strings."""
+        hashes = np.fromiter(
+            (zlib.crc32(item.encode("utf-8")) for item in items),
+            dtype=np.uint64,
+            count=len(items)
+        ) % _PRIME
+        # a * h + b stays below 2**63 because every operand is below 2**31
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+
+class NearDuplicateCache:
+    """Answer cache that also matches differently phrased versions of a cached query.
+
+    Queries are reduced to sets of word shingles and indexed with MinHash LSH, so a lookup
+    only compares against the few entries sharing a band bucket, whatever the cache size.
+    A candidate is a hit when its exact Jaccard similarity reaches the threshold, and it asks
+    the same question: same question words, and not its words in reverse order.
+
+    >>> cache = NearDuplicateCache()
+    >>> cache.set("What's the capital of France?", "Paris")
+    >>> cache.get("Capital of France?"), cache.get("What is France's capital?")
+    ('Paris', 'Paris')
+    >>> cache.set("latest AI news", "news")
+    >>> cache.get("what's the latest news in AI?")
+    'news'
+    >>> cache.set("Who founded Apple?", "Steve Jobs and Steve Wozniak")
+    >>> cache.get("When was Apple founded?") is None
+    True
+    >>> cache.set("Why is Java faster than Python?", "JIT")
+    >>> cache.get("Why is Python faster than Java?") is None
+    True
+
+    With a `shared` cache (e.g. a SQLiteCache used by every worker process), entries are
+    also written there under their exact words, and a local miss is looked up in it.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        ttl: Optional[float] = 3600,
+        max_entries: int = 100_000,
+        num_perm: int = 64,
+        shingle_size: int = 1,
+        shared: Optional[Any] = None
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shingle_size = shingle_size
+        self.hasher = MinHasher(num_perm)
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self.shared = shared
+
+        # entry id -> (query key, shingles, band keys, value, expiry), least recently used first
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # (band index, band hash) -> ids of the entries in that bucket
+        self._buckets: Dict[Tuple[int, bytes], set] = {}
+        # query key -> entry id, to replace rather than duplicate an entry
+        self._by_key: Dict[tuple, int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(query: str) -> Tuple[FrozenSet[str], Tuple[str, ...]]:
+        """Question words and words of a query, which two matching queries must agree on."""
+        return question_words(query), tuple(tokenize(query))
+
+    @staticmethod
+    def _same_question(key: tuple, other: tuple) -> bool:
+        return key[0] == other[0] and not reverses(list(key[1]), list(other[1]))
+
+    def _band_keys(self, items: FrozenSet[str]) -> List[Tuple[int, bytes]]:
+        signature = self.hasher.signature(items)
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def _shared_key(key: tuple) -> str:
+        asked, tokens = key
+        return " ".join(sorted(asked)) + ": " + " ".join(tokens)
+
+    def _remove(self, entry_id: int) -> None:
+        key, _, band_keys, _, _ = self._entries.pop(entry_id)
+        self._by_key.pop(key, None)
+        for band_key in band_keys:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def get(self, query: str) -> Optional[Any]:
+        """Return the value cached for the most similar query, or None."""
+        key = self._key(query)
+        items = shingles(list(key[1]), self.shingle_size)
+        if not items:
+            return None
+
+        with self._lock:
+            now = time.monotonic()
+
+            # Exact match on the words needs no hashing at all
+            entry_id = self._by_key.get(key)
+            candidates = {entry_id} if entry_id is not None else set()
+            if not candidates:
+                for band_key in self._band_keys(items):
+                    candidates.update(self._buckets.get(band_key, ()))
+
+            best_id, best_score = None, self.threshold
+            for candidate in candidates:
+                entry_key, entry_items, _, _, expires_at = self._entries[candidate]
+                if expires_at is not None and expires_at <= now:
+                    self._remove(candidate)
+                    continue
+                if not self._same_question(key, entry_key):
+                    continue
+                score = jaccard(items, entry_items)
+                if score >= best_score:
+                    best_id, best_score = candidate, score
+
+            if best_id is not None:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+                return self._entries[best_id][3]
+
+        # Another process may have answered the same query
+        value = self.shared.get(self._shared_key(key)) if self.shared is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._insert(key, items, value)
+        return value
+
+    def set(self, query: str, value: Any) -> None:
+        """Cache a value for a query."""
+        key = self._key(query)
+        items = shingles(list(key[1]), self.shingle_size)
+        if not items or self.max_entries <= 0:
+            return
+
+        self._insert(key, items, value)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key), value)
+
+    def _insert(self, key: tuple, items: FrozenSet[str], value: Any) -> None:
+        band_keys = self._band_keys(items)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            previous = self._by_key.get(key)
+            if previous is not None:
+                self._remove(previous)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (key, items, band_keys, value, expires_at)
+            self._by_key[key] = entry_id
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, set()).add(entry_id)
+
+            # Evict the least recently used entries
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove every entry (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._by_key.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+                "shared": self.shared.stats() if self.shared is not None else None,
+            }
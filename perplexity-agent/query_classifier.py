@@ -0,0 +1,110 @@
+import re
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List
+
+_WORD = re.compile(r"[A-Za-z0-9][\w'-]*")
+
+# Words joining several questions or aspects into one query
+CONJUNCTIONS = frozenset({"and", "or", "versus", "vs", "while", "whereas", "but", "also", "plus"})
+
+# Phrases asking for an analysis rather than a fact
+ANALYSIS_CUES = (
+    "compare", "comparison", "difference", "differ", "pros and cons", "advantages", "disadvantages",
+    "impact", "effect", "affect", "change", "influence", "history of", "evolution", "explain", "analy",
+    "relationship", "trend", "overview", "implications", "strategy", "strategies", "should i", "recommend",
+    "best way", "step by step", "latest", "recent", "news",
+)
+
+# Openings of factoid questions, answerable by a single lookup
+FACTOID_OPENINGS = (
+    "what is", "what's", "what are", "who is", "who was", "who are", "who wrote", "who invented",
+    "who founded", "who won", "when is", "when was", "when did", "where is", "where was", "which",
+    "how many", "how much", "how old", "how tall", "how long", "how far", "how big",
+    "is ", "are ", "does ", "did ", "was ", "define ", "capital of", "population of",
+)
+
+
+def _inside_entity(words: List[str], index: int) -> bool:
+    """Whether a conjunction joins two capitalized words, as in "Bosnia and Herzegovina"."""
+    return 0 < index < len(words) - 1 and words[index - 1][0].isupper() and words[index + 1][0].isupper()
+
+
+@dataclass(frozen=True)
+class QueryFeatures:
+    """Surface features of a query used to estimate its complexity."""
+    words: int
+    questions: int
+    conjunctions: int
+    commas: int
+    entities: int
+    analysis_cues: int
+    factoid: bool
+
+    @classmethod
+    def extract(cls, query: str) -> "QueryFeatures":
+        text = query.strip()
+        lowered = text.lower()
+        words = _WORD.findall(text)
+
+        # Runs of capitalized words after the first one approximate named entities
+        entities = 0
+        previous_capitalized = False
+        for word in words[1:]:
+            capitalized = word[0].isupper() or word[0].isdigit()
+            if capitalized and not previous_capitalized:
+                entities += 1
+            previous_capitalized = capitalized
+
+        return cls(
+            words=len(words),
+            questions=max(1, text.count("?")),
+            conjunctions=sum(
+                1 for i, word in enumerate(words)
+                if word.lower() in CONJUNCTIONS and not _inside_entity(words, i)
+            ),
+            commas=text.count(",") + text.count(";"),
+            entities=entities,
+            analysis_cues=sum(1 for cue in ANALYSIS_CUES if cue in lowered),
+            factoid=lowered.startswith(FACTOID_OPENINGS),
+        )
+
+
+class QueryClassifier:
+    """Decides locally whether a query is simple enough to skip decomposition.
+
+    A query is simple when its complexity score (a weighted sum of its features) stays
+    below `threshold`: short single questions about one or two entities, such as
+    "What is the capital of France?", score low; multi-part, comparative or analytical
+    queries score high.
+    """
+
+    def __init__(self, threshold: float = 1.0, max_words: int = 14):
+        self.threshold = threshold
+        self.max_words = max_words
+
+    def score(self, features: QueryFeatures) -> float:
+        """Complexity score of a query; 0 for the simplest factoid questions."""
+        score = 0.0
+        score += max(0, features.words - 8) / 6
+        score += 1.5 * (features.questions - 1)
+        score += 1.0 * features.conjunctions
+        score += 0.75 * features.commas
+        score += 0.5 * max(0, features.entities - 2)
+        score += 1.5 * features.analysis_cues
+        if not features.factoid:
+            score += 0.5
+        return score
+
+    def is_simple(self, query: str) -> bool:
+        """Whether the query can go straight to a single research call."""
+        features = QueryFeatures.extract(query)
+        return features.words <= self.max_words and self.score(features) < self.threshold
+
+    def explain(self, query: str) -> Dict[str, Any]:
+        """Features, score and decision for a query, for debugging the thresholds."""
+        features = QueryFeatures.extract(query)
+        return {
+            **asdict(features),
+            "score": round(self.score(features), 3),
+            "simple": self.is_simple(query),
+        }
@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agent import PerplexityAgent, research_failed
+from cache import TTLCache, normalize_text
+
+# Steps of a run, in order
+DECOMPOSE = "decompose"
+RESEARCH = "research"
+SYNTHESIZE = "synthesize"
+DONE = "done"
+
+
+class QueryProgress:
+    """Progress of a query running in the background, filled by the agent callbacks.
+
+    UI sessions poll snapshot() instead of being called back, so the worker thread never
+    touches a UI session and any number of sessions can follow the same run.
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.stage = DECOMPOSE
+        self.current_task: Optional[str] = None
+        self.subtasks: List[str] = []
+        self.results: List[Tuple[str, str]] = []
+        self.answer_chunks: List[str] = []
+        self.answer: Optional[str] = None
+        # Whether the answer is the local summary the agent falls back to when synthesis fails
+        self.degraded = False
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.stage == DONE
+
+    def callbacks(self) -> Dict[str, Callable]:
+        """Agent callbacks recording the progress."""
+        def on_subtasks(subtasks: List[str]):
+            with self._lock:
+                self.subtasks = list(subtasks)
+                self.stage = RESEARCH
+
+        def on_task_start(task: str):
+            with self._lock:
+                self.current_task = task
+
+        def on_task_complete(task: str, result: str):
+            with self._lock:
+                self.results.append((task, result))
+
+        def on_synthesize_start():
+            with self._lock:
+                self.stage = SYNTHESIZE
+                self.current_task = None
+
+        def on_answer_token(token: str):
+            with self._lock:
+                self.answer_chunks.append(token)
+
+        def on_answer_degraded():
+            with self._lock:
+                self.degraded = True
+
+        return {
+            "on_subtasks": on_subtasks,
+            "on_task_start": on_task_start,
+            "on_task_complete": on_task_complete,
+            "on_synthesize_start": on_synthesize_start,
+            "on_answer_token": on_answer_token,
+            "on_answer_degraded": on_answer_degraded
+        }
+
+    def finish(self, answer: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.answer = answer
+            self.error = error
+            self.stage = DONE
+            self.finished_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """A consistent copy of the progress, for rendering."""
+        with self._lock:
+            return {
+                "query": self.query,
+                "stage": self.stage,
+                "current_task": self.current_task,
+                "subtasks": list(self.subtasks),
+                "results": list(self.results),
+                "partial_answer": "".join(self.answer_chunks),
+                "answer": self.answer,
+                "degraded": self.degraded,
+                "error": self.error,
+                "elapsed": (self.finished_at or time.time()) - self.started_at,
+            }
+
+
+class QueryRunner:
+    """Runs the agent on a shared thread pool for every UI session of the process.
+
+    submit() returns at once with the progress of the query: a finished one from the answer
+    cache (bounded, entries expire after cache_ttl seconds), the run already in progress
+    for the same query, or a new run. Sessions never block on the agent, and at most
+    `workers` queries run at once.
+    """
+
+    def __init__(
+        self,
+        agent: PerplexityAgent,
+        workers: int = 8,
+        cache_size: int = 1000,
+        cache_ttl: Optional[float] = 3600
+    ):
+        self.agent = agent
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ui-query")
+        # Finished runs, shared by every session
+        self.answers = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self._running: Dict[str, QueryProgress] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, query: str) -> QueryProgress:
+        """Start answering a query in the background, or join or reuse an earlier run of it."""
+        key = normalize_text(query)
+        cached = self.answers.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            progress = self._running.get(key)
+            if progress is None:
+                progress = QueryProgress(query)
+                self._running[key] = progress
+                self.executor.submit(self._run, key, progress)
+            return progress
+
+    def _run(self, key: str, progress: QueryProgress) -> None:
+        try:
+            answer = self.agent.run(progress.query, callbacks=progress.callbacks())
+            if answer.startswith("Error:"):
+                progress.finish(error=answer)
+            else:
+                progress.finish(answer)
+                # Answers with failed research or synthesis are not kept, so asking again retries them
+                if not progress.degraded and not any(research_failed(result) for _, result in progress.results):
+                    self.answers.set(key, progress)
+        except Exception as e:
+            progress.finish(error=f"Error: {str(e)}")
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = len(self._running)
+        return {"running": running, "answers": self.answers.stats()}
@@ -0,0 +1,184 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+OK = "ok"
+THROTTLED = "throttled"
+FAILED = "failed"
+
+
+class AdaptiveRateLimiter:
+    """Token bucket and AIMD concurrency limit shared by every model call of the process.
+
+    The bucket refills at `rate` calls per second: the configured quota, or unlimited until
+    the first throttle when no quota is known. Each success grows the concurrency limit by
+    increase / limit (about +increase per round of calls) and the rate by rate_increase per
+    second of calls. A throttle (429/503) multiplies both by `decrease`, at most once per
+    `cooldown` seconds so a burst of rejections counts as a single congestion signal.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_concurrency: int = 32,
+        initial_concurrency: Optional[int] = None,
+        min_concurrency: int = 1,
+        min_rate: float = 0.5,
+        increase: float = 1.0,
+        rate_increase: float = 2.0,
+        decrease: float = 0.85,
+        cooldown: float = 1.0
+    ):
+        self.max_rate = requests_per_second
+        self.rate = requests_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(initial_concurrency or max_concurrency)
+        self.min_rate = min_rate
+        self.increase = increase
+        self.rate_increase = rate_increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.tokens = self._capacity()
+        self._refilled = time.monotonic()
+        self._last_decrease = -math.inf
+        # Completion times of the last second, to estimate the accepted rate
+        self._completions: Deque[float] = deque()
+
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+        self.admitted = 0
+        self.throttled = 0
+        self.waits = 0
+
+    def _capacity(self) -> float:
+        if self.rate is None:
+            return 0.0
+        # One second worth of calls unless configured
+        return max(1.0, self.burst if self.burst is not None else self.rate)
+
+    def _take(self) -> Optional[float]:
+        """Take a slot and a token if possible (lock held).
+
+        Returns 0 when admitted, the seconds until the next token, or None to wait for a release.
+        """
+        if self.in_flight >= max(self.min_concurrency, int(self.limit)):
+            return None
+
+        if self.rate is not None:
+            now = time.monotonic()
+            self.tokens = min(self._capacity(), self.tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+
+        self.in_flight += 1
+        self.admitted += 1
+        return 0.0
+
+    def acquire(self) -> None:
+        """Block until the call may start."""
+        with self._released:
+            waited = False
+            while True:
+                wait = self._take()
+                if wait == 0:
+                    self.waits += waited
+                    return
+                waited = True
+                self._released.wait(wait)
+
+    async def aacquire(self) -> None:
+        """Wait, without blocking the event loop, until the call may start."""
+        loop = asyncio.get_running_loop()
+        waited = False
+        while True:
+            released = None
+            with self._lock:
+                wait = self._take()
+                if wait == 0:
+                    self.waits += waited
+                    return
+                if wait is None:
+                    released = loop.create_future()
+                    self._async_waiters.append((loop, released))
+            waited = True
+
+            if released is not None:
+                await released
+            else:
+                await asyncio.sleep(wait)
+
+    def release(self, outcome: str = OK) -> None:
+        """Free the slot of a finished call and adapt the limits to its outcome."""
+        with self._released:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == OK:
+                self._on_success(now)
+            elif outcome == THROTTLED:
+                self._on_throttle(now)
+
+            self._released.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+
+        for loop, released in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, released)
+            except RuntimeError:
+                # The waiter's loop is closed
+                pass
+
+    def _on_success(self, now: float) -> None:
+        self._completions.append(now)
+        while self._completions and self._completions[0] < now - 1:
+            self._completions.popleft()
+
+        # Additive increase
+        self.limit = min(float(self.max_concurrency), self.limit + self.increase / self.limit)
+        if self.rate is not None:
+            self.rate += self.rate_increase / self.rate
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+
+    def _on_throttle(self, now: float) -> None:
+        self.throttled += 1
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+
+        # Multiplicative decrease, starting from the accepted rate when no quota was known
+        self.limit = max(float(self.min_concurrency), self.limit * self.decrease)
+        accepted = sum(1 for t in self._completions if t >= now - 1)
+        current = self.rate if self.rate is not None else max(accepted, self.min_rate)
+        self.rate = max(self.min_rate, current * self.decrease)
+        # Pause new calls until the bucket refills
+        self.tokens = 0.0
+        self._refilled = now
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limits and admission counters."""
+        with self._lock:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "rate": round(self.rate, 3) if self.rate is not None else None,
+                "admitted": self.admitted,
+                "throttled": self.throttled,
+                "waited": self.waits,
+            }
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+
+class Flight:
+    """One in-flight execution shared by every caller with the same key.
+
+    Callback events emitted by the execution are recorded and forwarded to every
+    subscriber, and replayed to subscribers that join late, so each caller sees
+    the same sequence of events as if it had run the work itself. The execution
+    only emits the events some subscriber registered by then.
+    """
+
+    def __init__(self, callback_names: Iterable[str]):
+        self.callback_names = tuple(callback_names)
+        # Names registered by at least one subscriber
+        self.registered: set = set()
+        self.events: List[Tuple[str, tuple]] = []
+        self.subscribers: List[Dict[str, Callable]] = []
+        self.lock = threading.Lock()
+
+        # Set once the execution has finished
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Future] = None
+        # Callers currently awaiting the task (asyncio only)
+        self.waiters = 0
+
+    def subscribe(self, callbacks: Optional[Dict[str, Callable]]) -> None:
+        """Add a subscriber and replay the events it missed."""
+        if not callbacks:
+            return
+
+        with self.lock:
+            for name, args in self.events:
+                if name in callbacks:
+                    callbacks[name](*args)
+            self.subscribers.append(callbacks)
+            self.registered.update(name for name in callbacks if name in self.callback_names)
+
+    def emit(self, name: str, *args) -> None:
+        """Record an event and forward it to the current subscribers."""
+        with self.lock:
+            self.events.append((name, args))
+            for callbacks in self.subscribers:
+                if name in callbacks:
+                    callbacks[name](*args)
+
+    @property
+    def callbacks(self) -> "FlightCallbacks":
+        """Callbacks to hand to the shared execution."""
+        return FlightCallbacks(self)
+
+
+class FlightCallbacks(Mapping):
+    """Callbacks of a shared execution: those registered by some subscriber so far.
+
+    The work can skip what nobody listens to (e.g. streaming the answer for on_answer_token),
+    and still sees a name registered by a subscriber joining later. Events are forwarded
+    under the flight's lock, so they never run concurrently.
+    """
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+
+    def __getitem__(self, name: str) -> Callable:
+        if name not in self.flight.registered:
+            raise KeyError(name)
+        return lambda *args: self.flight.emit(name, *args)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.flight.registered
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.flight.registered))
+
+    def __len__(self) -> int:
+        return len(self.flight.registered)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single execution (threads)."""
+
+    def __init__(self, callback_names: Iterable[str] = ()):
+        self.callback_names = tuple(callback_names)
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+
+        # Number of executions started, and of callers that joined one instead
+        self.leaders = 0
+        self.followers = 0
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[Dict[str, Callable]], Any],
+        callbacks: Optional[Dict[str, Callable]] = None
+    ) -> Any:
+        """Run fn(shared_callbacks) once for all concurrent callers of key and return its result."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight(self.callback_names)
+                self._flights[key] = flight
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        flight.subscribe(callbacks)
+
+        if leader:
+            try:
+                flight.result = fn(flight.callbacks)
+            except BaseException as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stats(self) -> Dict[str, Any]:
+        """Return coalescing counters."""
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "in_flight": len(self._flights),
+        }
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent calls with the same key into a single execution (asyncio)."""
+
+    def __init__(self, callback_names: Iterable[str] = ()):
+        self.callback_names = tuple(callback_names)
+        # Flights are keyed per event loop, a task can only be awaited from its own loop
+        self._flights: Dict[Tuple[int, Hashable], Flight] = {}
+
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[Dict[str, Callable]], Awaitable[Any]],
+        callbacks: Optional[Dict[str, Callable]] = None
+    ) -> Any:
+        """Await fn(shared_callbacks) once for all concurrent callers of key and return its result."""
+        flight_key = (id(asyncio.get_running_loop()), key)
+        flight = self._flights.get(flight_key)
+
+        if flight is None:
+            flight = Flight(self.callback_names)
+            self._flights[flight_key] = flight
+            self.leaders += 1
+            flight.subscribe(callbacks)
+
+            # Run the work in its own task so a cancelled caller doesn't cancel it for the others
+            # (it is cancelled with the last of its callers)
+            flight.task = asyncio.ensure_future(fn(flight.callbacks))
+            flight.task.add_done_callback(lambda _, flight=flight: self._forget(flight_key, flight))
+        else:
+            self.followers += 1
+            flight.subscribe(callbacks)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            # Nobody is left to use the result: stop the work instead of letting it run on
+            if flight.waiters == 1 and not flight.task.done():
+                self._forget(flight_key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, flight_key: Tuple[int, Hashable], flight: Flight) -> None:
+        """Stop sharing a flight, unless a newer one already took its key."""
+        if self._flights.get(flight_key) is flight:
+            del self._flights[flight_key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return coalescing counters."""
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "in_flight": len(self._flights),
+        }
@@ -0,0 +1,233 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+INF_LABEL = 'le="+Inf"'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """A monotonically increasing Prometheus counter."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus histogram with cumulative buckets."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, INF_LABEL)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """A set of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Metrics shared by every agent of the process
+metrics = MetricsRegistry()
+
+QUERY_SECONDS = metrics.histogram(
+    "perplexity_query_duration_seconds", "End-to-end duration of a query.", ["source"])
+NODE_SECONDS = metrics.histogram(
+    "perplexity_node_duration_seconds", "Wall time of each graph node.", ["node"])
+LLM_SECONDS = metrics.histogram(
+    "perplexity_llm_call_duration_seconds", "Wall time of each model call.", ["node", "outcome"])
+LLM_PROMPT_TOKENS = metrics.counter(
+    "perplexity_llm_prompt_tokens_total", "Prompt tokens sent to the model.", ["node"])
+LLM_OUTPUT_TOKENS = metrics.counter(
+    "perplexity_llm_output_tokens_total", "Output tokens generated by the model.", ["node"])
+LLM_RETRIES = metrics.counter(
+    "perplexity_llm_retries_total", "Model calls retried after a failure.", ["node"])
+LLM_HEDGES = metrics.counter(
+    "perplexity_llm_hedges_total", "Duplicate calls fired for slow model calls, by which attempt won.",
+    ["node", "result"])
+CACHE_LOOKUPS = metrics.counter(
+    "perplexity_cache_lookups_total", "Cache lookups by cache and result.", ["cache", "result"])
+FAST_PATHS = metrics.counter(
+    "perplexity_fast_path_total", "Model calls skipped for simple queries, by skipped step.", ["step"])
+FALLBACKS = metrics.counter(
+    "perplexity_fallbacks_total", "Nodes that fell back to a local result after a failure.", ["node"])
+COMPRESSION_RATIO = metrics.histogram(
+    "perplexity_compression_ratio", "Share of the research tokens kept as evidence by the compress node.",
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75, 1))
+
+
+class Span:
+    """A timed operation of a request, with attributes and child spans."""
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict[str, Any]:
+        origin = self.start if origin is None else origin
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "children": [child.to_dict(origin) for child in list(self.children)],
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    """Span tree of one request."""
+
+    def __init__(self, name: str = "query", **attributes: Any):
+        self.root = Span(name, attributes)
+
+    @contextmanager
+    def activate(self) -> Iterator["Trace"]:
+        """Record the spans opened in this context (and tasks/threads started from it)."""
+        token = _current_span.set(self.root)
+        try:
+            yield self
+        finally:
+            _current_span.reset(token)
+            self.root.end = time.perf_counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.root.to_dict()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Open a child span of the current span; without an active trace the span is discarded."""
+    current = Span(name, attributes)
+    parent = _current_span.get()
+    if parent is None:
+        yield current
+        return
+    parent.children.append(current)
+
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end = time.perf_counter()
+
+
+@contextmanager
+def attach(parent: Optional[Span]) -> Iterator[None]:
+    """Open the spans of the block under a given span, e.g. in work started from a nested span."""
+    token = _current_span.set(parent)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def current_span() -> Optional[Span]:
+    """The innermost open span, if a trace is active."""
+    return _current_span.get()